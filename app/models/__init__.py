@@ -1,10 +1,13 @@
 import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from .base import Base
 from .user import User
+from .blob import Blob
 from .image import Image
+from .derivative import Derivative
+from .pool import InstrumentedQueuePool, pool_metrics
 
 # 加载环境变量
 load_dotenv()
@@ -16,22 +19,73 @@ DB_HOST = os.getenv("MYSQL_HOST", "localhost")
 DB_PORT = os.getenv("MYSQL_PORT", "3306")
 DB_NAME = os.getenv("MYSQL_DB")
 
-# 创建数据库连接 URL
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
+# 连接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# 小于 MySQL 的 wait_timeout，避免拿到已被服务端断开的连接
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# 创建数据库连接 URL（DATABASE_URL 可整体覆盖，例如本地用 SQLite）
+DATABASE_URL = os.getenv("DATABASE_URL") or \
+    f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL)
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 每个请求（线程）一个会话，请求结束时在 teardown 中释放
+db_session = scoped_session(SessionLocal)
 
 
-# 获取数据库会话
+# 获取当前请求的数据库会话；同一请求内（包括 login_required）拿到的是同一个会话
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    return db_session()
+
+
+# 释放当前请求的会话，连接归还连接池
+def remove_db():
+    db_session.remove()
+
+
+def init_db(app):
+    @app.teardown_appcontext
+    def shutdown_session(exception=None):
+        remove_db()
+
+
+def get_pool_metrics():
+    pool = engine.pool
+    metrics = {
+        'pool_class': type(pool).__name__,
+        'wait_count': pool_metrics.wait_count,
+        'wait_seconds_total': pool_metrics.wait_seconds_total,
+        'wait_seconds_max': pool_metrics.wait_seconds_max,
+        'timeouts': pool_metrics.timeouts,
+    }
+    if hasattr(pool, 'checkedout'):
+        metrics.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    return metrics
+
+
 # 创建所有表
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,27 @@
+import os
+from uuid import uuid4
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from .base import Base
+
+BLOB_ROOT = os.getenv('BLOB_ROOT', os.path.join('uploads', 'blobs'))
+
+
+class Blob(Base):
+    """按内容哈希存储的文件，多条 images 记录可以引用同一个 blob"""
+    __tablename__ = "blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), unique=True, nullable=False)
+    file_path = Column(String(255), nullable=False)
+    file_size = Column(Integer)
+    mime_type = Column(String(255))
+    # 引用该 blob 的 images 记录数，降到 0 时删除文件
+    ref_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, default=datetime.now)
+
+    @staticmethod
+    def build_path(content_hash: str, ext: str) -> str:
+        # 带随机后缀：blob 被删除后又有同样内容上传时，新文件不会和正在删除的旧文件同名
+        return os.path.join(BLOB_ROOT, content_hash[:2], content_hash[2:4],
+                            f"{content_hash}-{uuid4().hex[:8]}{ext}")
@@ -0,0 +1,41 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
+from .base import Base
+
+
+class Derivative(Base):
+    """图片的转换结果。原图记录不再被修改，每种 (原图, 参数) 对应一行；
+    spec_hash 由原图内容哈希和规范化参数决定，内容相同的原图共用同一个文件"""
+    __tablename__ = "derivatives"
+    __table_args__ = (
+        UniqueConstraint('image_id', 'spec_hash', name='uq_derivatives_image_spec'),
+        # 按 spec_hash 查找可复用的文件、按 file_path 判断文件是否还有引用
+        Index('ix_derivatives_spec_hash', 'spec_hash'),
+        Index('ix_derivatives_file_path', 'file_path'),
+        # 超出磁盘预算时按最近访问时间淘汰
+        Index('ix_derivatives_last_accessed', 'last_accessed_at'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), nullable=False)
+    spec_hash = Column(String(64), nullable=False)
+    file_path = Column(String(255), nullable=False)
+    file_size = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+    image_format = Column(String(16))
+    mime_type = Column(String(255))
+    created_at = Column(DateTime, default=datetime.now)
+    last_accessed_at = Column(DateTime, default=datetime.now)
+
+    def to_dict(self):
+        return {
+            'image_id': self.image_id,
+            'derivative_key': self.spec_hash,
+            'file_size': self.file_size,
+            'width': self.width,
+            'height': self.height,
+            'image_format': self.image_format,
+            'mime_type': self.mime_type,
+            'created_at': datetime.timestamp(self.created_at) if self.created_at else None,
+        }
@@ -1,7 +1,7 @@
 import os
 from uuid import uuid4
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, SmallInteger, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from . import Base
@@ -9,6 +9,10 @@ from . import Base
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        # 按用户列出图片时的 keyset 分页：WHERE user_id = ? AND (created_at, id) < (?, ?)
+        Index('ix_images_user_created_id', 'user_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255))
@@ -16,6 +20,20 @@ class Image(Base):
     file_path = Column(String(255))
     file_size = Column(Integer)
     mime_type = Column(String(255))
+    # 文件内容的 SHA-256，上传时边接收边计算，衍生图缓存直接用它作为源图标识
+    content_hash = Column(String(64), index=True)
+    # 文件所在的 blob；为空表示旧数据，文件为该记录独占
+    blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=True, index=True)
+    # 上传时解析一次的图片元数据，之后校验参数、列表展示都不必再打开文件
+    width = Column(Integer, index=True)
+    height = Column(Integer, index=True)
+    image_format = Column(String(16), index=True)
+    color_mode = Column(String(16))
+    frame_count = Column(Integer)
+    # EXIF 方向（1-8），1 表示无需旋转
+    orientation = Column(SmallInteger)
+    # 16px 预览图的 data URI
+    placeholder = Column(Text)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     created_at = Column(DateTime, default=datetime.now)  # 使用datetime.utcnow
     updated_at = Column(DateTime, default=datetime.now,
@@ -42,6 +60,14 @@ class Image(Base):
             'file_path': self.file_path,
             'file_size': self.file_size,
             'mime_type': self.mime_type,
+            'content_hash': self.content_hash,
+            'width': self.width,
+            'height': self.height,
+            'image_format': self.image_format,
+            'color_mode': self.color_mode,
+            'frame_count': self.frame_count,
+            'orientation': self.orientation,
+            'placeholder': self.placeholder,
             # 将datetime对象转换为UNIX时间戳的方法
             'created_at': datetime.timestamp(self.created_at) if self.created_at else None,
             'updated_at': datetime.timestamp(self.updated_at) if self.updated_at else None
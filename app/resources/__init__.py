@@ -3,7 +3,11 @@ from flask_restful import Api
 
 def init_resources(api: Api):
     from .auth import RegisterResource, LoginResource
-    from .image import ImageResource, ImageListResource, ImageTransformResource
+    from .image import ImageResource, ImageListResource, ImageTransformResource, \
+        ImageRawResource, ImageDerivativeResource, ImagePresetResource, ImageRenderResource, \
+        ImageRenderUrlResource, ImageBatchUploadResource, ImageBatchTransformResource
+    from .job import JobResource
+    from .stats import DatabasePoolResource, MetricsResource
 
     # 注册认证相关路由
     api.add_resource(RegisterResource, '/register')
@@ -12,6 +16,29 @@ def init_resources(api: Api):
     # 注册图片相关路由
     api.add_resource(ImageResource, '/image/<int:image_id>',
                      endpoint='get_image')
+    api.add_resource(ImageRawResource, '/image/<int:image_id>/raw',
+                     endpoint='get_image_raw')
+    api.add_resource(ImageDerivativeResource,
+                     '/image/<int:image_id>/derivatives/<string:key>',
+                     endpoint='get_image_derivative')
+    api.add_resource(ImagePresetResource,
+                     '/image/<int:image_id>/presets/<string:name>',
+                     endpoint='get_image_preset')
     api.add_resource(ImageListResource, '/images')
+    api.add_resource(ImageBatchUploadResource, '/images/batch',
+                     endpoint='upload_images_batch')
+    api.add_resource(ImageBatchTransformResource, '/images/transform:batch',
+                     endpoint='transform_images_batch')
     api.add_resource(ImageTransformResource,
                      '/images/<int:image_id>/transform')
+    api.add_resource(ImageRenderResource, '/images/<int:image_id>/render',
+                     endpoint='render_image')
+    api.add_resource(ImageRenderUrlResource, '/images/<int:image_id>/render/sign',
+                     endpoint='sign_render_url')
+
+    # 注册异步任务路由
+    api.add_resource(JobResource, '/jobs/<string:job_id>', endpoint='get_job')
+
+    # 注册运行状态路由
+    api.add_resource(DatabasePoolResource, '/stats/db-pool')
+    api.add_resource(MetricsResource, '/metrics')
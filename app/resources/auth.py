@@ -22,7 +22,7 @@ class RegisterResource(Resource):
 
     def post(self):
         args = self.parser.parse_args()
-        db = next(get_db())
+        db = get_db()
 
         try:
             # 检查用户名是否存在
@@ -63,7 +63,7 @@ class LoginResource(Resource):
 
     def post(self):
         args = self.parser.parse_args()
-        db = next(get_db())
+        db = get_db()
 
         try:
             user = db.query(User).filter(
@@ -1,20 +1,167 @@
+import json
+import logging
 import os
+import time
 import traceback
 from datetime import datetime
 from flask_restful import Resource, reqparse
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
 from werkzeug.utils import secure_filename
-from flask import request, url_for, current_app
+from flask import Response, redirect, request, send_file, stream_with_context, url_for, \
+    current_app
 
 from app.models import get_db
 from app.models.image import Image
 from app.utils.auth_decorator import login_required
-from app.services.image_processor import ImageListService, ImageService, ImageTransformService
+from app.services.image_processor import ImageListService, ImageService, ImageTransformService, \
+    BATCH_TRANSFORM_MAX_ITEMS, DEFAULT_PAGE_SIZE
+from app.services.encoders import format_from_extension, negotiate_format
+from app.services import render_urls
+from app.services.blob_store import remove_files
+from app.services.decode import check_pixels
+from app.services.ingest import BATCH_UPLOAD_MAX_BYTES, BATCH_UPLOAD_MAX_FILES, \
+    MAX_CONTENT_LENGTH, USER_STORAGE_QUOTA, UnsupportedImage, UploadTooLarge
+from app.services.jobs import get_job_queue
+from app.services.metrics import IMAGE_BYTES, UPLOAD_STAGE_SECONDS
+from app.services.presets import IMAGE_PRESETS, IMAGE_PRESETS_EAGER
+
+logger = logging.getLogger(__name__)
+
+
+def preset_urls(image_id: int) -> dict:
+    return {name: url_for('get_image_preset', image_id=image_id, name=name, _external=True)
+            for name in IMAGE_PRESETS}
+
+
+def upload_payload(image: Image) -> dict:
+    return {
+        'id': image.id,
+        'filename': image.filename,
+        # 生成图片访问URL
+        'url': url_for('get_image', image_id=image.id, _external=True),
+        'size': image.file_size,
+        'mime_type': image.mime_type,
+        'content_hash': image.content_hash,
+        'width': image.width,
+        'height': image.height,
+        'image_format': image.image_format,
+        'frame_count': image.frame_count,
+        'orientation': image.orientation,
+        'placeholder': image.placeholder,
+        'presets': preset_urls(image.id),
+        'created_at': str(image.created_at),
+        'user_id': image.user_id
+    }
+
+
+def acquire_blob(blobs, ingest, result, stored_paths: list):
+    """按内容哈希存储：同样的内容已经存在时只增加引用计数，临时文件直接丢弃；
+    新内容才把临时文件原子地移动到 blob 路径上（扩展名按识别出的格式），路径记到 stored_paths，
+    回滚时由调用方删除。返回 (blob, 是否新写入)"""
+    def store(path):
+        ingest.commit(path)
+        stored_paths.append(path)
+
+    with UPLOAD_STAGE_SECONDS.time(stage='save'):
+        blob = blobs.acquire(result.content_hash, result.size, result.mime_type,
+                             result.extension, store)
+    if not ingest.committed:
+        ingest.discard()
+    return blob, ingest.committed
+
+
+def header_metadata(result) -> dict:
+    # 进程池排队已满时使用文件头中已知的信息
+    return {'width': result.width, 'height': result.height, 'image_format': result.format}
+
+
+def corrupt_image(e: Exception) -> Exception:
+    # 解析元数据时顺带完整解码一次，损坏的文件在这里被拒绝
+    if isinstance(e, (OSError, SyntaxError, ValueError)):
+        return UnsupportedImage(f"Image data is corrupt: {e}")
+    return e
+
+
+def new_image_record(file, blob, result, metadata: dict, user_id: int) -> Image:
+    return Image(
+        filename=secure_filename(file.filename),
+        storage_name=os.path.basename(blob.file_path),
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        mime_type=result.mime_type,
+        content_hash=result.content_hash,
+        blob_id=blob.id,
+        user_id=user_id,
+        **metadata
+    )
+
+
+def enqueue_presets(payload: dict, user_id: int):
+    # 常用尺寸在后台一次解码生成，首次访问时只是读文件
+    if not (IMAGE_PRESETS_EAGER and IMAGE_PRESETS):
+        return
+    try:
+        get_job_queue().enqueue('presets', payload, user_id=user_id)
+    except Exception:
+        # 入队失败不影响上传，首次访问时会按需生成
+        logger.exception("Failed to enqueue presets")
+
+
+def from_timestamp(value, name: str):
+    # 超出范围的时间戳（例如 1e20、inf）在 fromtimestamp 中抛 OverflowError/OSError，按参数错误返回 400
+    if value is None:
+        return None
+    try:
+        return datetime.fromtimestamp(value)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"Invalid {name}: {value}")
+
+
+def source_format(image: Image):
+    # 原图格式（按存储的扩展名），没有图片时为 None
+    return format_from_extension(os.path.splitext(image.storage_name)[1]) if image else None
+
+
+def upload_quota(image_service: ImageListService, user_id: int):
+    """用户剩余的存储配额（字节），不限制时返回 None"""
+    if not USER_STORAGE_QUOTA:
+        return None
+    return USER_STORAGE_QUOTA - image_service.get_storage_used(user_id)
+
+
+def set_ingest_limit(remaining=None):
+    # 先确定单个文件最多能接收多少字节：解析请求体时文件直接流式写入临时文件，
+    # 同时计算 SHA-256、识别格式，超限或不是图片会在读到那一块时立即中止
+    limit, limit_message = MAX_CONTENT_LENGTH, None
+    if remaining is not None and remaining < limit:
+        limit, limit_message = remaining, 'Upload exceeds the remaining storage quota'
+    request.ingest_limit = limit
+    request.ingest_limit_message = limit_message
+
+
+def batch_error(e: Exception) -> tuple:
+    """批量接口中单项失败的 (状态码, 消息)，与对应的单个接口一致"""
+    if isinstance(e, HTTPException):
+        return e.code, e.description
+    if isinstance(e, ValueError):
+        return 400, str(e)
+    logger.error("Batch item failed", exc_info=e)
+    return 500, str(e)
+
+
+def ndjson_response(lines):
+    """每一项一行 JSON（application/x-ndjson），完成一项就发给客户端，不等整批结束"""
+    response = Response(stream_with_context(json.dumps(line) + '\n' for line in lines),
+                        mimetype='application/x-ndjson')
+    # 经过 nginx 时不缓冲，逐行到达客户端
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 class ImageListResource(Resource):
     def __init__(self):
-        self.db = next(get_db())
+        self.db = get_db()
         self.image_service = ImageListService(self.db)
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('file',
@@ -26,78 +173,203 @@ class ImageListResource(Resource):
 
     @login_required
     def post(self, current_user=None):
-        args = self.parser.parse_args()
+        remaining = upload_quota(self.image_service, current_user.id)
+        if remaining is not None and remaining <= 0:
+            return {'message': 'Storage quota exceeded'}, 413
+        set_ingest_limit(remaining)
+
+        # 解析 multipart 请求体（werkzeug 在这里读取上传内容并写入 IngestWriter）
+        with UPLOAD_STAGE_SECONDS.time(stage='parse'):
+            args = self.parser.parse_args()
         file = args['file']
+        if file is None:
+            return {'message': 'Image file is required'}, 400
 
-        # 验证文件类型
+        # 验证文件类型：扩展名只做初筛，实际格式以文件内容为准
         if not self.image_service.allowed_file(file.filename):
             return {'message': 'File type not allowed'}, 400
+        ingest = file.stream
+        result = ingest.finish()
 
+        stored_paths = []
         try:
-            # 生成安全的文件名
-            storage_name = Image.generate_storage_name(file.filename)
-            file_path = Image.get_file_path(storage_name)
-
-            # 确保目录存在
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-            # 检查目录权限
-            if not os.access(os.path.dirname(file_path), os.W_OK):
-                return {'message': 'Directory is not writable'}, 500
-
-            # 保存文件
-            file.save(file_path)
+            blob, stored = acquire_blob(self.image_service.blobs, ingest, result, stored_paths)
 
-            # 确认文件是否存在
-            if not os.path.exists(file_path):
-                return {'message': 'File was not saved properly'}, 500
+            # 元数据只在新内容写入时解析一次，带 EXIF 方向的图片同时转正
+            with UPLOAD_STAGE_SECONDS.time(stage='metadata'):
+                try:
+                    metadata = self.image_service.blobs.get_metadata(
+                        blob, stored=stored, fallback=header_metadata(result))
+                except Exception as e:
+                    raise corrupt_image(e)
 
             # 创建数据库记录
-            new_image = Image(
-                filename=secure_filename(file.filename),
-                storage_name=storage_name,
-                file_path=file_path,
-                file_size=os.path.getsize(file_path),
-                mime_type=file.content_type,
-                user_id=current_user.id
-            )
-
-            self.image_service.create_image(new_image)
-
-            # 生成图片访问URL
-            image_url = url_for('get_image',
-                                image_id=new_image.id,
-                                _external=True)
+            new_image = new_image_record(file, blob, result, metadata, current_user.id)
+            with UPLOAD_STAGE_SECONDS.time(stage='commit'):
+                self.image_service.create_image(new_image)
+            IMAGE_BYTES.inc(new_image.file_size, direction='in', path='upload')
+            enqueue_presets({'image_id': new_image.id}, current_user.id)
 
             return {
                 'message': 'Image uploaded successfully',
-                'image': {
-                    'id': new_image.id,
-                    'filename': new_image.filename,
-                    'url': image_url,
-                    'size': new_image.file_size,
-                    'mime_type': new_image.mime_type,
-                    'created_at': str(new_image.created_at),
-                    'user_id': current_user.id
-                }
+                'image': upload_payload(new_image)
             }, 201
 
         except Exception as e:
             self.db.rollback()
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            ingest.discard()
+            # 回滚后新建的 blob 记录不存在了，它的文件也要删掉；已有的 blob 不受影响
+            remove_files(stored_paths)
+            if isinstance(e, HTTPException):
+                raise
             # 打印完整的异常堆栈
             print("Exception occurred:", traceback.format_exc())
             return {'message': f'Upload failed: {str(e)}'}, 500
 
+    @login_required
     def get(self, current_user=None):
-        images = self.image_service.get_image_by_user_id(current_user.id)
-        return {'images': [image.to_dict() for image in images]}, 200
+        parser = reqparse.RequestParser()
+        parser.add_argument('limit', type=int, location='args',
+                            default=DEFAULT_PAGE_SIZE)
+        parser.add_argument('cursor', type=str, location='args')
+        parser.add_argument('mime_type', type=str, location='args')
+        # 时间范围使用 UNIX 时间戳，与返回的 created_at 一致
+        parser.add_argument('created_after', type=float, location='args')
+        parser.add_argument('created_before', type=float, location='args')
+        parser.add_argument('orientation', type=str, location='args')
+        args = parser.parse_args()
+
+        try:
+            images, next_cursor = self.image_service.get_image_by_user_id(
+                current_user.id,
+                limit=args['limit'],
+                cursor=args['cursor'],
+                mime_type=args['mime_type'],
+                created_after=from_timestamp(args['created_after'], 'created_after'),
+                created_before=from_timestamp(args['created_before'], 'created_before'),
+                orientation=args['orientation'])
+        except ValueError as e:
+            return {'message': str(e)}, 400
+
+        # 查询结果是只含所需列的 Row，字段与 Image 同名，直接复用 to_dict
+        return {'images': [Image.to_dict(image) for image in images],
+                'next_cursor': next_cursor}, 200
+
+
+class ImageBatchUploadResource(Resource):
+    """一次请求上传多个文件（multipart 中多个 file 字段）：只认证一次，所有图片记录一次插入、一次提交。
+    每个文件的结果是一行 JSON（NDJSON），失败的文件一确定就返回，不影响其他文件"""
+
+    def __init__(self):
+        self.db = get_db()
+        self.image_service = ImageListService(self.db)
+        super().__init__()
+
+    @login_required
+    def post(self, current_user=None):
+        remaining = upload_quota(self.image_service, current_user.id)
+        if remaining is not None and remaining <= 0:
+            return {'message': 'Storage quota exceeded'}, 413
+        set_ingest_limit(remaining)
+        # 单个文件出错时只丢弃这个文件，整个请求体按批量上限读取
+        request.ingest_defer_errors = True
+        request.ingest_max_content_length = BATCH_UPLOAD_MAX_BYTES
+
+        with UPLOAD_STAGE_SECONDS.time(stage='parse'):
+            files = request.files.getlist('file')
+        if not files:
+            return {'message': 'Image file is required'}, 400
+        if len(files) > BATCH_UPLOAD_MAX_FILES:
+            for file in files:
+                file.stream.discard()
+            return {'message': f'At most {BATCH_UPLOAD_MAX_FILES} files per batch'}, 400
+        return ndjson_response(self._upload(files, current_user.id, remaining))
+
+    def _upload(self, files: list, user_id: int, remaining):
+        blobs = self.image_service.blobs
+        # (序号, 文件, 上传结果, blob, 是否新写入)
+        accepted = []
+        stored_paths = []
+        reported = set()
+
+        def fail(index, file, e):
+            reported.add(index)
+            status, message = batch_error(e)
+            return {'index': index, 'filename': file.filename, 'status': status,
+                    'message': message}
+
+        try:
+            for index, file in enumerate(files):
+                ingest = file.stream
+                try:
+                    if not self.image_service.allowed_file(file.filename or ''):
+                        ingest.discard()
+                        raise UnsupportedImage('File type not allowed')
+                    result = ingest.finish()
+                    if remaining is not None:
+                        if result.size > remaining:
+                            ingest.discard()
+                            raise UploadTooLarge('Upload exceeds the remaining storage quota')
+                        remaining -= result.size
+                except HTTPException as e:
+                    yield fail(index, file, e)
+                    continue
+
+                blob, stored = acquire_blob(blobs, ingest, result, stored_paths)
+                accepted.append((index, file, result, blob, stored))
+
+            # 新内容的元数据在进程池中并行解析
+            with UPLOAD_STAGE_SECONDS.time(stage='metadata'):
+                outcomes = blobs.get_metadata_many([
+                    (blob, stored, header_metadata(result))
+                    for _, _, result, blob, stored in accepted])
+
+            unused_paths = []
+            new_images = []
+            for (index, file, result, blob, _), metadata in zip(accepted, outcomes):
+                if isinstance(metadata, Exception):
+                    # 这个文件不入库，它的 blob 引用也要还回去
+                    unused_paths.append(blobs.release(blob.id))
+                    yield fail(index, file, corrupt_image(metadata))
+                    continue
+                new_images.append((index, new_image_record(file, blob, result, metadata,
+                                                           user_id)))
+
+            with UPLOAD_STAGE_SECONDS.time(stage='commit'):
+                self.image_service.add_images([image for _, image in new_images])
+                # 提交后对象会过期，先取出返回内容，避免逐行重新查询
+                payloads = [(index, upload_payload(image)) for index, image in new_images]
+                self.db.commit()
+        except GeneratorExit:
+            # 客户端在提交前断开：整批不入库，新写入的文件也删掉
+            self.db.rollback()
+            remove_files(stored_paths)
+            raise
+        except Exception as e:
+            self.db.rollback()
+            for file in files:
+                file.stream.discard()
+            # 整个事务回滚，本批新建的 blob 都不存在了
+            remove_files(stored_paths)
+            for index, file in enumerate(files):
+                if index not in reported:
+                    yield fail(index, file, e)
+            return
+        remove_files(unused_paths)
+
+        for _, image in payloads:
+            IMAGE_BYTES.inc(image['size'], direction='in', path='upload')
+        if payloads:
+            enqueue_presets({'image_ids': [image['id'] for _, image in payloads]}, user_id)
+
+        for index, image in payloads:
+            yield {'index': index, 'filename': image['filename'], 'status': 201,
+                   'image': image}
 
 
 class ImageResource(Resource):
     def __init__(self):
-        self.db = next(get_db())
+        self.db = get_db()
         self.image_service = ImageService(self.db)
         super().__init__()
 
@@ -109,8 +381,15 @@ class ImageResource(Resource):
                     'image': {'id': image.id,
                               'filename': image.filename,
                               'url': image.file_path,
+                              'raw_url': url_for('get_image_raw',
+                                                 image_id=image.id,
+                                                 _external=True),
                               'size': image.file_size,
                               'mime_type': image.mime_type,
+                              'width': image.width,
+                              'height': image.height,
+                              'placeholder': image.placeholder,
+                              'presets': preset_urls(image.id),
                               'created_at': str(image.created_at),
                               'user_id': image.user_id}
                     }, 200
@@ -134,10 +413,192 @@ class ImageResource(Resource):
             return {'message': f'Update failed: {str(e)}'}, 500
 
 
+class ImageRawResource(Resource):
+    def __init__(self):
+        self.db = get_db()
+        self.image_service = ImageService(self.db)
+        super().__init__()
+
+    @login_required
+    def get(self, image_id: int, current_user=None):
+        image = self.image_service.get_image_by_id(image_id)
+        if not image or image.user_id != current_user.id or \
+                not os.path.exists(image.file_path):
+            return {'message': 'Image not found'}, 404
+
+        # send_file 负责 If-None-Match / If-Modified-Since -> 304 和 Range；
+        # 文件通过 wsgi.file_wrapper 交给服务器 sendfile，不经过 Python 读写
+        response = send_file(
+            os.path.abspath(image.file_path),
+            mimetype=image.mime_type,
+            conditional=True,
+            etag=image.content_hash or
+            self.image_service.derivatives.source_hash(image.file_path))
+        # 转换不再覆盖原图，同一个 URL 的内容不会变；只有替换上传会改变，此时 ETag 也会变
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+class ImageDerivativeResource(Resource):
+    def __init__(self):
+        self.db = get_db()
+        self.image_service = ImageService(self.db)
+        super().__init__()
+
+    @login_required
+    def get(self, image_id: int, key: str, current_user=None):
+        image = self.image_service.get_image_by_id(image_id)
+        if not image or image.user_id != current_user.id:
+            return {'message': 'Image not found'}, 404
+        derivative = self.image_service.derivatives.lookup(image_id, key)
+        if derivative is None:
+            return {'message': 'Derivative not found'}, 404
+
+        # 衍生图按内容寻址，同一个 key 的内容永远不变，可以长期缓存；
+        # 传 max_age 时 send_file 才会去掉默认的 no-cache 并标记为 public
+        response = send_file(os.path.abspath(derivative.file_path),
+                             mimetype=derivative.mime_type, conditional=True, etag=key,
+                             max_age=60 * 60 * 24 * 365)
+        response.cache_control.immutable = True
+        return response
+
+
+class ImagePresetResource(Resource):
+    def __init__(self):
+        self.db = get_db()
+        self.image_tran_service = ImageTransformService(self.db)
+        super().__init__()
+
+    @login_required
+    def get(self, image_id: int, name: str, current_user=None):
+        if name not in IMAGE_PRESETS:
+            return {'message': 'Preset not found'}, 404
+        image = self.image_tran_service.image_service.get_image_by_id(image_id)
+        if not image or image.user_id != current_user.id:
+            return {'message': 'Image not found'}, 404
+
+        # 后台任务还没完成（或已被淘汰）时在进程池中按需生成，排队已满时返回 503
+        derivative = self.image_tran_service.get_preset(image, name)
+        if derivative is None:
+            return {'message': 'Preset could not be generated'}, 500
+
+        # 原图不可变，预设 URL 的内容只随替换上传改变：私有缓存并用 ETag 校验
+        response = send_file(os.path.abspath(derivative.file_path),
+                             mimetype=derivative.mime_type, conditional=True,
+                             etag=derivative.spec_hash)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+class ImageRenderResource(Resource):
+    """GET 按需渲染：参数规范化后作为衍生图 key，从原图渲染一次后直接读文件。
+    带 sig 的签名 URL 不需要登录（CDN 边缘节点可以匿名回源），没有 sig 时按 JWT 校验"""
+
+    def __init__(self):
+        self.db = get_db()
+        self.image_tran_service = ImageTransformService(self.db)
+        super().__init__()
+
+    def get(self, image_id: int):
+        image = self.image_tran_service.image_service.get_image_by_id(image_id)
+        try:
+            params = render_urls.canonicalize(request.args, source_format(image))
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        if 'sig' not in request.args:
+            return self._render_private(image, params)
+
+        try:
+            render_urls.verify(image_id, params, request.args['sig'])
+        except render_urls.InvalidSignature as e:
+            return {'message': str(e)}, 403
+        if not image or params.get('v') != render_urls.content_version(
+                self.image_tran_service.content_hash(image)):
+            # 原图已被删除或替换，旧的签名 URL 失效
+            return {'message': 'Image not found'}, 404
+
+        # 参数顺序或写法不规范时重定向到 canonical URL，CDN 上相同的渲染只缓存一份
+        query = f"{render_urls.canonical_query(params)}&sig={request.args['sig']}"
+        if request.query_string.decode() != query:
+            return redirect(f"{request.path}?{query}", code=301)
+
+        response = self._send(image, params)
+        if response is None:
+            return {'message': 'Image could not be rendered'}, 500
+        # send_file 默认带 no-cache，CDN 会每次回源校验，这里要去掉
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 60 * 60 * 24 * 365
+        if 'exp' in params:
+            response.cache_control.max_age = max(0, int(params['exp']) - int(time.time()))
+        else:
+            response.cache_control.immutable = True
+        return response
+
+    @login_required
+    def _render_private(self, image: Image, params: dict, current_user=None):
+        if not image or image.user_id != current_user.id:
+            return {'message': 'Image not found'}, 404
+        response = self._send(image, params)
+        if response is None:
+            return {'message': 'Image could not be rendered'}, 500
+        # 同一个 URL 在原图被替换后内容会变，只允许私有缓存并用 ETag 校验
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    def _send(self, image: Image, params: dict):
+        transformations = render_urls.to_transformations(params)
+        if 'resize' in transformations:
+            check_pixels(transformations['resize']['width'],
+                         transformations['resize']['height'], 'Output')
+        output_format = None
+        if params.get('fmt') == 'auto':
+            output_format = negotiate_format(request.headers.get('Accept'), source_format(image))
+
+        # 在进程池中同步渲染，排队已满时返回 503
+        derivative = self.image_tran_service.render(image.id, transformations, output_format)
+        if derivative is None:
+            return None
+        response = send_file(os.path.abspath(derivative.file_path),
+                             mimetype=derivative.mime_type, conditional=True,
+                             etag=derivative.spec_hash)
+        if params.get('fmt') == 'auto':
+            response.vary.add('Accept')
+        return response
+
+
+class ImageRenderUrlResource(Resource):
+    """为自己的图片签出渲染 URL，参数与 GET /images/<id>/render 相同"""
+
+    def __init__(self):
+        self.db = get_db()
+        self.image_tran_service = ImageTransformService(self.db)
+        super().__init__()
+
+    @login_required
+    def get(self, image_id: int, current_user=None):
+        image = self.image_tran_service.image_service.get_image_by_id(image_id)
+        if not image or image.user_id != current_user.id:
+            return {'message': 'Image not found'}, 404
+        try:
+            params = render_urls.canonicalize(request.args, source_format(image))
+            query = render_urls.sign(image_id, params, render_urls.content_version(
+                self.image_tran_service.content_hash(image)))
+        except ValueError as e:
+            return {'message': str(e)}, 400
+        except render_urls.InvalidSignature as e:
+            return {'message': str(e)}, 503
+        return {'url': f"{url_for('render_image', image_id=image_id, _external=True)}?{query}"}, 200
+
+
 class ImageTransformResource(Resource):
     def __init__(self):
-        self.db = next(get_db())
+        self.db = get_db()
         self.image_tran_service = ImageTransformService(self.db)
+        self.queue = get_job_queue()
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('transformations', type=dict,
                                  required=True, help='Transformations type is required')
@@ -148,11 +609,130 @@ class ImageTransformResource(Resource):
         args = self.parser.parse_args()
         transformations = args['transformations']
 
-        # 验证转换参数
-        if not self.image_tran_service.validate_transformations(transformations):
+        # 和其他图片接口一样，别人的图片按不存在处理
+        image = self.image_tran_service.image_service.get_image_by_id(image_id)
+        if not image or image.user_id != current_user.id:
+            return {'message': 'Image not found'}, 404
+
+        # 验证转换参数（已知尺寸时裁剪越界直接拒绝，不必打开文件）
+        if not self.image_tran_service.validate_transformations(transformations, image):
             return {'message': 'Invalid transformation parameters'}, 400
+        # 源图或输出尺寸超过像素上限时直接返回 413，不必进入队列
+        if image.width and image.height:
+            check_pixels(image.width, image.height)
+        if 'resize' in transformations:
+            check_pixels(int(transformations['resize']['width']),
+                         int(transformations['resize']['height']), 'Output')
+
+        # 未指定 format 时根据 Accept 头选择输出格式（例如支持 WebP 的浏览器拿到 WebP）
+        output_format = None
+        if 'format' not in transformations:
+            output_format = negotiate_format(request.headers.get('Accept'), source_format(image))
+
+        # 放入任务队列，由 worker 进程执行，客户端通过 /jobs/<id> 查询结果
+        job_id = self.queue.enqueue('transform',
+                                    {'image_id': image_id,
+                                     'transformations': transformations,
+                                     'output_format': output_format},
+                                    user_id=current_user.id)
+        status_url = url_for('get_job', job_id=job_id, _external=True)
 
         return {
-            'message' : 'Image Successfully Transformed',
-            'image' : self.image_tran_service.process_image(image_id, transformations)
-        }, 202
+            'message': 'Image transformation accepted',
+            'job_id': job_id,
+            'status_url': status_url
+        }, 202, {'Location': status_url}
+
+
+class ImageBatchTransformResource(Resource):
+    """一次请求转换多张图片：同一组参数应用到多张图片（image_ids + transformations），
+    或每张图片各自的参数（items）。只认证一次、一次查询取出所有图片，渲染在进程池中并行，
+    每完成一项就以一行 JSON（NDJSON）返回"""
+
+    def __init__(self):
+        self.db = get_db()
+        self.image_tran_service = ImageTransformService(self.db)
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('image_ids', type=list, location='json')
+        self.parser.add_argument('transformations', type=dict, location='json')
+        self.parser.add_argument('items', type=list, location='json')
+        super().__init__()
+
+    @login_required
+    def post(self, current_user=None):
+        args = self.parser.parse_args()
+        try:
+            items = self._items(args)
+        except ValueError as e:
+            return {'message': str(e)}, 400
+
+        images = self.image_tran_service.image_service.get_images_by_ids(
+            [image_id for image_id, _ in items], current_user.id)
+        return ndjson_response(self._transform(items, images))
+
+    @staticmethod
+    def _items(args) -> list:
+        """请求体 -> [(image_id, transformations)]，格式不对时抛出 ValueError"""
+        if args['items'] is not None:
+            items = []
+            for item in args['items']:
+                if not isinstance(item, dict):
+                    raise ValueError('Each item needs an image_id')
+                items.append((item.get('image_id'),
+                              item.get('transformations', args['transformations'])))
+        elif args['image_ids'] is not None:
+            items = [(image_id, args['transformations']) for image_id in args['image_ids']]
+        else:
+            raise ValueError('image_ids or items is required')
+        if not items:
+            raise ValueError('No images to transform')
+        if len(items) > BATCH_TRANSFORM_MAX_ITEMS:
+            raise ValueError(f'At most {BATCH_TRANSFORM_MAX_ITEMS} images per batch')
+        for image_id, transformations in items:
+            if not isinstance(image_id, int) or isinstance(image_id, bool):
+                raise ValueError(f'Invalid image_id: {image_id!r}')
+            if not isinstance(transformations, dict):
+                raise ValueError(f'Transformations are required for image {image_id}')
+        return items
+
+    def _transform(self, items: list, images: dict):
+        accept = request.headers.get('Accept')
+        renders = []
+        # render_batch 中的位置 -> (请求中的序号, 图片 id)
+        positions = []
+        for index, (image_id, transformations) in enumerate(items):
+            image = images.get(image_id)
+            try:
+                if image is None:
+                    raise NotFound('Image not found')
+                # 与单个转换接口相同的校验，出错的项直接返回，不进入进程池
+                if not self.image_tran_service.validate_transformations(transformations, image):
+                    raise BadRequest('Invalid transformation parameters')
+                if image.width and image.height:
+                    check_pixels(image.width, image.height)
+                if 'resize' in transformations:
+                    check_pixels(int(transformations['resize']['width']),
+                                 int(transformations['resize']['height']), 'Output')
+            except HTTPException as e:
+                yield self._line(index, image_id, e)
+                continue
+            output_format = None
+            if 'format' not in transformations:
+                output_format = negotiate_format(accept, source_format(image))
+            renders.append((image, transformations, output_format))
+            positions.append((index, image_id))
+
+        for n, outcome in self.image_tran_service.render_batch(renders):
+            index, image_id = positions[n]
+            yield self._line(index, image_id, outcome)
+
+    @staticmethod
+    def _line(index: int, image_id, outcome) -> dict:
+        if isinstance(outcome, Exception):
+            status, message = batch_error(outcome)
+            return {'index': index, 'image_id': image_id, 'status': status,
+                    'message': message}
+        return {'index': index, 'image_id': image_id, 'status': 200,
+                'derivative': outcome,
+                'url': url_for('get_image_derivative', image_id=image_id,
+                               key=outcome['derivative_key'], _external=True)}
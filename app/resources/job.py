@@ -0,0 +1,30 @@
+from flask_restful import Resource
+
+from app.services.jobs import get_job_queue
+from app.utils.auth_decorator import login_required
+
+
+class JobResource(Resource):
+    def __init__(self):
+        self.queue = get_job_queue()
+        super().__init__()
+
+    @login_required
+    def get(self, job_id: str, current_user=None):
+        job = self.queue.get(job_id)
+        # 只能查看自己提交的任务
+        if not job or job['user_id'] != current_user.id:
+            return {'message': 'Job not found'}, 404
+
+        return {
+            'job': {
+                'id': job['id'],
+                'type': job['type'],
+                'status': job['status'],
+                'attempts': job['attempts'],
+                'result': job['result'],
+                'error': job['error'],
+                'created_at': job['created_at'],
+                'updated_at': job['updated_at'],
+            }
+        }, 200
@@ -0,0 +1,37 @@
+from flask import Response
+from flask_restful import Resource
+
+from app.models import get_pool_metrics
+from app.services.metrics import registry, render
+
+
+class DatabasePoolResource(Resource):
+    def get(self):
+        return {'pool': get_pool_metrics()}, 200
+
+
+class MetricsResource(Resource):
+    """Prometheus 文本格式的监控指标"""
+
+    def get(self):
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def _pool_samples():
+    metrics = get_pool_metrics()
+    samples = [
+        ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection',
+         [({}, metrics['wait_seconds_total'])]),
+        ('db_pool_wait_total', 'counter', 'Connection checkouts', [({}, metrics['wait_count'])]),
+        ('db_pool_timeouts_total', 'counter', 'Connection checkouts that timed out',
+         [({}, metrics['timeouts'])]),
+    ]
+    if 'checked_out' in metrics:
+        samples.append(('db_pool_connections', 'gauge', 'Pooled connections by state',
+                        [({'state': 'checked_in'}, metrics['checked_in']),
+                         ({'state': 'checked_out'}, metrics['checked_out']),
+                         ({'state': 'overflow'}, metrics['overflow'])]))
+    return samples
+
+
+registry.register_collector(_pool_samples)
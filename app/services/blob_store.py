@@ -0,0 +1,172 @@
+import logging
+import os
+from uuid import uuid4
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models.blob import Blob
+from app.models.image import Image
+from app.services.decode import ImageOverBudget
+from app.services.executor import ExecutorBusy, get_executor
+from app.services.ingest import UnsupportedImage
+from app.services.metadata import METADATA_FIELDS, extract_metadata
+from app.services.orientation import normalize_orientation
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path: str, data: bytes):
+    """先写临时文件再原子替换，其他请求不会读到写了一半的文件；
+    临时文件名每次随机，同一进程的多个线程同时写同一个路径也不会互相覆盖"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_files([tmp_path])
+        raise
+
+
+def remove_files(paths):
+    """在事务提交之后删除不再被引用的文件"""
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Failed to remove blob file %s: %s", path, e)
+
+
+class BlobService:
+    """内容寻址存储：相同内容只存一份，images 记录通过 blob_id 引用并计数。
+    acquire / release 都不提交事务，由调用方和 images 记录的修改一起提交"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_by_hash(self, content_hash: str):
+        return self.db.query(Blob).filter(Blob.content_hash == content_hash).first()
+
+    def _increment(self, content_hash: str):
+        updated = self.db.query(Blob).filter(Blob.content_hash == content_hash) \
+            .update({Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False)
+        if not updated:
+            return None
+        return self.db.query(Blob).filter(Blob.content_hash == content_hash) \
+            .populate_existing().one()
+
+    def acquire(self, content_hash: str, file_size: int, mime_type: str, ext: str, store):
+        """引用一份内容；内容已存在时只把引用计数 +1，不再写文件。
+        内容不存在时调用 store(path) 把文件放到 blob 路径上"""
+        blob = self._increment(content_hash)
+        if blob is not None:
+            return blob
+
+        path = Blob.build_path(content_hash, ext)
+        store(path)
+        blob = Blob(content_hash=content_hash, file_path=path, file_size=file_size,
+                    mime_type=mime_type, ref_count=1)
+        try:
+            with self.db.begin_nested():
+                self.db.add(blob)
+        except IntegrityError:
+            # 并发上传了同样的内容且对方先插入：丢掉自己写的文件，引用对方的 blob
+            remove_files([path])
+            blob = self._increment(content_hash)
+            if blob is None:
+                raise
+        return blob
+
+    def get_metadata(self, blob: Blob, stored: bool, fallback: dict = None) -> dict:
+        """新写入的内容解析一次文件得到元数据；已存在的内容直接复制引用同一 blob 的图片的元数据。
+        进程池排队已满时，已存在的内容返回 fallback（文件头中已知的信息）；新内容还要按 EXIF 方向转正，
+        不能跳过，ExecutorBusy 直接抛给调用方（503）"""
+        if not stored:
+            metadata = self._copied_metadata(blob)
+            if metadata is not None:
+                return metadata
+        try:
+            metadata = get_executor().run(extract_metadata, blob.file_path)
+            if stored and metadata.get('orientation', 1) != 1:
+                metadata = self._normalize_orientation(blob, metadata)
+            return metadata
+        except ExecutorBusy:
+            if stored:
+                raise
+            return dict(fallback or {})
+
+    def get_metadata_many(self, entries: list) -> list:
+        """批量版的 get_metadata，entries 为 (blob, stored, fallback)：需要解析的文件同时提交到进程池，
+        同一个 blob 只解析一次；返回与 entries 一一对应的元数据，解析失败的位置是异常对象"""
+        # blob id -> (blob, 是否新写入, fallback)，同一批里重复的内容合并
+        unique = {}
+        for blob, stored, fallback in entries:
+            _, seen_stored, seen_fallback = unique.get(blob.id, (blob, False, fallback))
+            unique[blob.id] = (blob, stored or seen_stored, seen_fallback)
+
+        results = {}
+        parse = []
+        for blob_id, (blob, stored, _) in unique.items():
+            metadata = None if stored else self._copied_metadata(blob)
+            if metadata is None:
+                parse.append(blob_id)
+            else:
+                results[blob_id] = metadata
+
+        for n, outcome in get_executor().imap_unordered(
+                extract_metadata, [(unique[blob_id][0].file_path,) for blob_id in parse]):
+            blob, stored, fallback = unique[parse[n]]
+            if isinstance(outcome, ExecutorBusy):
+                # 新内容不能跳过方向转正，这一项按 503 失败
+                if not stored:
+                    outcome = dict(fallback or {})
+            elif not isinstance(outcome, Exception) and stored and \
+                    outcome.get('orientation', 1) != 1:
+                try:
+                    outcome = self._normalize_orientation(blob, outcome)
+                except Exception as e:
+                    outcome = e
+            results[blob.id] = outcome
+        return [results[blob.id] for blob, _, _ in entries]
+
+    def _copied_metadata(self, blob: Blob):
+        row = self.db.query(*(getattr(Image, field) for field in METADATA_FIELDS)) \
+            .filter(Image.blob_id == blob.id, Image.width.isnot(None)).first()
+        return dict(zip(METADATA_FIELDS, row)) if row is not None else None
+
+    def _normalize_orientation(self, blob: Blob, metadata: dict) -> dict:
+        """新内容按 EXIF 方向转正一次再保存，之后的变换都不必再考虑方向；做不到时（动图、超出内存预算）
+        拒绝上传（415/422），保证入库的原图方向都是 1；
+        文件内容变了但 blob 仍按上传内容的哈希登记，同样的上传仍会命中这份文件"""
+        if (metadata.get('frame_count') or 1) > 1:
+            # 渲染不再处理方向，不能转正的图片不入库，否则结果永远是歪的
+            raise UnsupportedImage("Animated images with an EXIF orientation are not supported")
+        data = get_executor().run(normalize_orientation, blob.file_path, metadata['orientation'])
+        if data is None:
+            raise ImageOverBudget(
+                "Turning this image upright needs more memory than RENDER_MEMORY_BUDGET allows; "
+                "upload it already rotated or as a smaller image")
+        write_atomic(blob.file_path, data)
+        blob.file_size = len(data)
+        return get_executor().run(extract_metadata, blob.file_path)
+
+    def release(self, blob_id: int):
+        """引用计数 -1；最后一个引用消失时删除 blob 记录，返回需要在提交后删除的文件路径"""
+        self.db.query(Blob).filter(Blob.id == blob_id) \
+            .update({Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False)
+        blob = self.db.query(Blob).filter(Blob.id == blob_id).populate_existing().first()
+        if blob is None:
+            return None
+        path = blob.file_path
+        # 条件删除：期间有新的引用时计数已经大于 0，不会误删
+        deleted = self.db.query(Blob).filter(Blob.id == blob_id, Blob.ref_count <= 0) \
+            .delete(synchronize_session=False)
+        if deleted:
+            self.db.expunge(blob)
+            return path
+        return None
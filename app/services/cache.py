@@ -1,28 +1,303 @@
-import redis
 import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
 
-# 将健值对存入到cache中，并设置过期时间；
-class RedisCache:
-    def __init__(self, host='localhost', port=6379, db=0):
-        self.redis_client = redis.Redis(host=host, port=port, db=db)
+import redis
 
-    def set(self, key, value, expire=None):
-        try:
-            value_str = json.dumps(value)
-            self.redis_client.set(key, value_str, expire)
-        except Exception as e:
-            print(e)
+from app.services.metrics import CACHE_REQUESTS, REDIS_COMMAND_SECONDS, cache_hit, cache_miss
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 1.0))
+# Redis 不可用后，多久再尝试连接（秒）
+REDIS_RETRY_INTERVAL = float(os.getenv('REDIS_RETRY_INTERVAL', 5))
+
+# 进程内前置缓存：条目数上限，以及条目在本进程最多保留多久（其他进程的修改最多延迟这么久可见）
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 4096))
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', 30))
+
+# 之前版本写入的 pickle 数据带这个前缀；不再反序列化（能写 Redis 的人就能在所有进程中执行代码），当作未命中
+_PICKLE_MARKER = b'\x01'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> redis.ConnectionPool:
+    """进程内共享的 Redis 连接池（redis-py 在 fork 后会自动重建）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = redis.ConnectionPool(
+                host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                health_check_interval=30)
+        return _pool
+
+
+def get_redis_client() -> redis.Redis:
+    return redis.Redis(connection_pool=get_connection_pool())
+
+
+def dumps(value) -> bytes:
+    # 缓存的值都是 dict/list/str/数字这样的普通类型；JSON 反序列化不会执行代码（tuple 读回来是 list）
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: bytes):
+    if data is None or data[:1] == _PICKLE_MARKER:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        logger.warning("Ignoring undecodable cache entry")
+        return None
+
+
+class TTLCache:
+    """容量受限的 LRU，每个条目有自己的过期时间"""
+
+    def __init__(self, max_entries: int = CACHE_LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
 
     def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _Health:
+    """记录 Redis 是否可用；不可用期间跳过 Redis，只用本地缓存"""
+
+    def __init__(self):
+        self._retry_at = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.time() >= self._retry_at
+
+    def mark_down(self, error: Exception):
+        if self.available:
+            logger.warning("Redis unavailable, falling back to local cache for %ss: %s",
+                           REDIS_RETRY_INTERVAL, error)
+        self._retry_at = time.time() + REDIS_RETRY_INTERVAL
+
+
+_local = TTLCache()
+_health = _Health()
+# 进程内的 single-flight 锁：key -> [Lock, 等待者数量]
+_flights = {}
+_flights_lock = threading.Lock()
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# 两级缓存：进程内 LRU + 共享的 Redis；值用 JSON 序列化
+class RedisCache:
+    def __init__(self, client: redis.Redis = None, local: TTLCache = None,
+                 local_ttl: float = CACHE_LOCAL_TTL):
+        # 传入 client 时（例如测试中的 fakeredis）使用独立的本地缓存和健康状态
+        self.redis_client = client or get_redis_client()
+        self.local = local or (_local if client is None else TTLCache())
+        self.health = _health if client is None else _Health()
+        self.local_ttl = local_ttl
+
+    def _local_expiry(self, expire=None) -> float:
+        ttl = self.local_ttl if expire is None else min(self.local_ttl, expire)
+        return time.time() + ttl
+
+    def _call(self, fn, default=None, command: str = 'other'):
+        if not self.health.available:
+            return default
+        start = time.perf_counter()
         try:
-            value_str = self.redis_client.get(key)
-            return json.loads(value_str)
-        except Exception as e:
-            print(e)
+            return fn()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.health.mark_down(e)
+        except redis.RedisError as e:
+            logger.warning("Redis command failed: %s", e)
+        finally:
+            REDIS_COMMAND_SECONDS.observe(time.perf_counter() - start, command=command)
+        return default
+
+    def set(self, key, value, expire=None, local=True):
+        data = dumps(value)
+        if local:
+            self.local.set(key, data, self._local_expiry(expire))
+        else:
+            self.local.delete(key)
+        self._call(lambda: self.redis_client.set(key, data, ex=expire), command='set')
+
+    def get(self, key, local=True):
+        # 本地缓存中存的是序列化后的字节，调用方修改返回值不会影响缓存
+        if local:
+            data = self.local.get(key)
+            if data is not None:
+                cache_hit('local')
+                return loads(data)
+            cache_miss('local')
+        data = self._call(lambda: self.redis_client.get(key), command='get')
+        value = loads(data)
+        if value is None:
+            cache_miss('redis')
+            return None
+        cache_hit('redis')
+        if local:
+            self.local.set(key, data, self._local_expiry())
+        return value
 
     def delete(self, key):
+        self.local.delete(key)
+        self._call(lambda: self.redis_client.delete(key), command='delete')
+
+    def get_many(self, keys: list) -> dict:
+        """批量读取，本地未命中的 key 用一次 MGET 取回"""
+        result = {}
+        missing = []
+        for key in keys:
+            data = self.local.get(key)
+            if data is not None:
+                result[key] = loads(data)
+            else:
+                missing.append(key)
+        CACHE_REQUESTS.inc(len(result), cache='local', result='hit')
+        if missing:
+            CACHE_REQUESTS.inc(len(missing), cache='local', result='miss')
+            values = self._call(lambda: self.redis_client.mget(missing), default=[],
+                                command='mget')
+            found = 0
+            for key, data in zip(missing, values):
+                value = loads(data)
+                if value is not None:
+                    self.local.set(key, data, self._local_expiry())
+                    result[key] = value
+                    found += 1
+            CACHE_REQUESTS.inc(found, cache='redis', result='hit')
+            CACHE_REQUESTS.inc(len(missing) - found, cache='redis', result='miss')
+        return result
+
+    def set_many(self, mapping: dict, expire=None):
+        """批量写入，所有 SET 放在一个 pipeline 中一次往返完成"""
+        encoded = {key: dumps(value) for key, value in mapping.items()}
+        for key, data in encoded.items():
+            self.local.set(key, data, self._local_expiry(expire))
+
+        def write():
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, data in encoded.items():
+                pipe.set(key, data, ex=expire)
+            pipe.execute()
+        self._call(write, command='pipeline')
+
+    def get_or_compute(self, key, compute, expire=None,
+                       lock_timeout: float = 30, wait_timeout: float = 30):
+        """缓存未命中时只计算一次：同进程内用线程锁，跨进程用 Redis 锁，其余请求等待结果"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with _flights_lock:
+            flight = _flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
         try:
-            self.redis_client.delete(key)
-        except Exception as e:
-            print(e)
+            with flight[0]:
+                # 拿到锁时，前一个持有者可能已经算好了
+                value = self.get(key)
+                if value is not None:
+                    return value
+                return self._compute_once(key, compute, expire,
+                                          lock_timeout, wait_timeout)
+        finally:
+            with _flights_lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    _flights.pop(key, None)
 
+    def acquire_lock(self, lock_key: str, timeout: float):
+        """获取跨进程锁，成功返回 token，已被占用返回 None；Redis 不可用时返回 False"""
+        if not self.health.available:
+            return False
+        token = uuid4().hex
+        acquired = self._call(
+            lambda: self.redis_client.set(lock_key, token, nx=True,
+                                          px=int(timeout * 1000)),
+            default=False, command='lock')
+        if acquired is False:
+            return False
+        return token if acquired else None
+
+    def release_lock(self, lock_key: str, token: str):
+        # 只释放自己持有的锁
+        self._call(lambda: self.redis_client.eval(_RELEASE_SCRIPT, 1, lock_key, token),
+                   command='unlock')
+
+    def lock_held(self, lock_key: str) -> bool:
+        return bool(self._call(lambda: self.redis_client.exists(lock_key), default=0,
+                              command='exists'))
+
+    def _compute_once(self, key, compute, expire, lock_timeout, wait_timeout):
+        lock_key = f"lock:{key}"
+        token = self.acquire_lock(lock_key, lock_timeout)
+
+        if token is None:
+            # 其他进程正在计算，等待它写入结果
+            deadline = time.time() + wait_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                value = self.get(key, local=False)
+                if value is not None:
+                    return value
+                if not self.lock_held(lock_key):
+                    break
+
+        try:
+            value = compute()
+            self.set(key, value, expire=expire)
+            return value
+        finally:
+            if token:
+                self.release_lock(lock_key, token)
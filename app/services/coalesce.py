@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from app.services.cache import RedisCache
+
+# 领头请求最长执行多久（秒），超过后锁自动过期，等待者可以接手
+COALESCE_LOCK_TIMEOUT = float(os.getenv('COALESCE_LOCK_TIMEOUT', 120))
+# 等待者最多等多久（秒）
+COALESCE_WAIT_TIMEOUT = float(os.getenv('COALESCE_WAIT_TIMEOUT', 60))
+# 结果在 Redis 中保留多久，供其他进程的等待者读取
+COALESCE_RESULT_EXPIRE = int(os.getenv('COALESCE_RESULT_EXPIRE', 60))
+COALESCE_POLL_INTERVAL = 0.05
+
+
+class CoalesceTimeout(Exception):
+    pass
+
+
+class CoalescedError(Exception):
+    """领头请求在其他进程中失败，等待者收到同样的错误信息"""
+    pass
+
+
+# 进程内正在执行的 key -> Future
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class RequestCoalescer:
+    """相同 key 的并发请求只执行一次：第一个请求执行，其余请求（跨线程、跨进程）等待它的结果。
+    结果需要可序列化且体积小（例如记录的 dict），会经 Redis 传给其他进程。"""
+
+    def __init__(self, cache: RedisCache = None,
+                 lock_timeout: float = COALESCE_LOCK_TIMEOUT,
+                 wait_timeout: float = COALESCE_WAIT_TIMEOUT):
+        self.cache = cache or RedisCache()
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+
+    def run(self, key: str, fn):
+        with _inflight_lock:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                _inflight[key] = future
+
+        if not leader:
+            try:
+                return future.result(timeout=self.wait_timeout)
+            except FutureTimeoutError:
+                raise CoalesceTimeout(f"Timed out waiting for in-flight request {key}")
+
+        try:
+            result = self._run_across_processes(key, fn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+    def _run_across_processes(self, key: str, fn):
+        lock_key = f"coalesce:lock:{key}"
+        result_key = f"coalesce:result:{key}"
+        deadline = time.time() + self.wait_timeout
+
+        while True:
+            # Redis 不可用时 acquire_lock 返回 False，退化为只在进程内合并
+            token = self.cache.acquire_lock(lock_key, self.lock_timeout)
+            if token is not None:
+                break
+            # 其他进程正在执行：等它写出结果；锁消失但没有结果（对方崩溃）则重新抢锁
+            while True:
+                outcome = self.cache.get(result_key, local=False)
+                if outcome is not None:
+                    if outcome['ok']:
+                        return outcome['value']
+                    raise CoalescedError(outcome['error'])
+                if time.time() >= deadline:
+                    raise CoalesceTimeout(
+                        f"Timed out waiting for in-flight request {key}")
+                if not self.cache.lock_held(lock_key):
+                    break
+                time.sleep(COALESCE_POLL_INTERVAL)
+
+        try:
+            # 清掉上一轮的结果，避免等待者读到旧值
+            self.cache.delete(result_key)
+            try:
+                value = fn()
+            except Exception as e:
+                self.cache.set(result_key, {'ok': False, 'error': str(e)},
+                               expire=COALESCE_RESULT_EXPIRE, local=False)
+                raise
+            self.cache.set(result_key, {'ok': True, 'value': value},
+                           expire=COALESCE_RESULT_EXPIRE, local=False)
+            return value
+        finally:
+            if token:
+                self.cache.release_lock(lock_key, token)
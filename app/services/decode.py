@@ -0,0 +1,57 @@
+import os
+import warnings
+
+from PIL import Image as PILImage
+from werkzeug.exceptions import RequestEntityTooLarge, UnprocessableEntity
+
+# 单张图片的像素上限（宽 x 高），上传和处理超过时返回 413
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 89_478_485))
+# 单次渲染允许占用的位图内存（字节），解码和中间结果的估算峰值超过时返回 422
+RENDER_MEMORY_BUDGET = int(os.getenv('RENDER_MEMORY_BUDGET', 512 * 1024 * 1024))
+
+# Pillow 在超过 MAX_IMAGE_PIXELS 两倍时抛 DecompressionBombError，之间只是警告；
+# 像素上限由 check_pixels 严格检查，Pillow 的阈值作为解析文件头时的兜底
+PILImage.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter('ignore', PILImage.DecompressionBombWarning)
+
+# 每像素字节数，Pillow 内部的多通道模式（包括 RGB）都按 4 字节存储
+_PIXEL_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+class ImageTooLarge(RequestEntityTooLarge):
+    pass
+
+
+class ImageOverBudget(UnprocessableEntity):
+    pass
+
+
+def bitmap_bytes(size: tuple, mode: str) -> int:
+    return size[0] * size[1] * _PIXEL_BYTES.get(mode, 4)
+
+
+def check_pixels(width: int, height: int, what: str = 'Image'):
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(
+            f"{what} is {width}x{height} pixels, the limit is {MAX_IMAGE_PIXELS} pixels")
+
+
+def check_budget(needed: int):
+    if needed > RENDER_MEMORY_BUDGET:
+        raise ImageOverBudget(
+            f"Processing this image needs about {needed // (1024 * 1024)} MiB, "
+            f"the limit is {RENDER_MEMORY_BUDGET // (1024 * 1024)} MiB; "
+            f"request a smaller size or upload a smaller image")
+
+
+def open_image(stream, formats=None):
+    """只解析文件头并检查像素上限，不解码"""
+    try:
+        img = PILImage.open(stream, formats=formats)
+    except PILImage.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    try:
+        check_pixels(*img.size)
+    except ImageTooLarge:
+        img.close()
+        raise
+    return img
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app.models.derivative import Derivative
+from app.services.blob_store import remove_files, write_atomic
+from app.services.cache import RedisCache
+
+DERIVATIVE_CACHE_DIR = os.getenv(
+    'DERIVATIVE_CACHE_DIR', os.path.join('uploads', 'derivatives'))
+DERIVATIVE_CACHE_MAX_BYTES = int(
+    os.getenv('DERIVATIVE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+DERIVATIVE_META_EXPIRE = 60 * 60 * 24 * 30
+# 最近访问时间的更新间隔（秒）：LRU 只需要粗略的时间，避免每次读取都写数据库
+DERIVATIVE_TOUCH_INTERVAL = int(os.getenv('DERIVATIVE_TOUCH_INTERVAL', 300))
+
+# 本进程对衍生图总大小的估计值，只有估计超限时才真正统计并淘汰
+_approx_bytes = None
+
+
+def file_content_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _normalize(value):
+    # 1 和 1.0 视为同一个参数，字典按 key 排序
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def canonical_spec(transformations: dict) -> str:
+    # 操作的先后顺序有意义（先 crop 再 resize 与反过来不同），所以保留顺序，只规范化参数
+    return json.dumps([[name, _normalize(params)]
+                       for name, params in transformations.items()],
+                      separators=(',', ':'))
+
+
+def derivative_key(source_hash: str, transformations: dict, encoder: str) -> str:
+    # encoder 是输出格式及其编码参数的稳定表示，见 encoders.encoder_signature
+    payload = '|'.join([source_hash, canonical_spec(transformations), encoder])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DerivativeCache:
+    """持久化的衍生图：derivatives 表记录 (原图, 参数哈希) -> 文件及尺寸/格式，文件按参数哈希存放在磁盘上。
+    总大小超出预算时按最近访问时间淘汰，被淘汰的衍生图下次请求时重新从原图渲染"""
+
+    def __init__(self, db, cache: RedisCache = None, root: str = DERIVATIVE_CACHE_DIR,
+                 max_bytes: int = DERIVATIVE_CACHE_MAX_BYTES):
+        self.db = db
+        self.cache = cache or RedisCache()
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def source_hash(self, path: str) -> str:
+        # 用 (路径, mtime, 大小) 记住源文件的哈希，避免每次都整读一遍
+        stat = os.stat(path)
+        memo_key = f"source_hash:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        return self.cache.get_or_compute(
+            memo_key, lambda: file_content_hash(path), expire=DERIVATIVE_META_EXPIRE)
+
+    def path_for(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def lookup(self, image_id: int, key: str):
+        """该图片的衍生图，命中时刷新最近访问时间；文件已被淘汰或删除时视为未命中"""
+        derivative = self.db.query(Derivative).filter(
+            Derivative.image_id == image_id, Derivative.spec_hash == key).first()
+        if derivative is None:
+            return None
+        if not os.path.exists(derivative.file_path):
+            self.db.delete(derivative)
+            self.db.commit()
+            return None
+        self._touch(derivative)
+        return derivative
+
+    def find(self, key: str):
+        """任意图片的同一衍生图（原图内容相同），可直接复用其文件"""
+        for derivative in self.db.query(Derivative).filter(Derivative.spec_hash == key).limit(5):
+            if os.path.exists(derivative.file_path):
+                return derivative
+        return None
+
+    def _touch(self, derivative: Derivative):
+        now = datetime.now()
+        if derivative.last_accessed_at is None or \
+                now - derivative.last_accessed_at > timedelta(seconds=DERIVATIVE_TOUCH_INTERVAL):
+            derivative.last_accessed_at = now
+            self.db.commit()
+
+    def store(self, image_id: int, key: str, data: bytes, ext: str, metadata: dict,
+              mime_type: str) -> Derivative:
+        """写入文件并登记到该图片名下"""
+        path = self.path_for(key, ext)
+        write_atomic(path, data)
+        derivative = self._insert(Derivative(
+            image_id=image_id, spec_hash=key, file_path=path, file_size=len(data),
+            width=metadata.get('width'), height=metadata.get('height'),
+            image_format=metadata.get('image_format'), mime_type=mime_type))
+        self._account(len(data))
+        return derivative
+
+    def link(self, image_id: int, existing: Derivative) -> Derivative:
+        """复用另一张内容相同的图片已经生成的文件，不再渲染和写盘"""
+        return self._insert(Derivative(
+            image_id=image_id, spec_hash=existing.spec_hash, file_path=existing.file_path,
+            file_size=existing.file_size, width=existing.width, height=existing.height,
+            image_format=existing.image_format, mime_type=existing.mime_type))
+
+    def _insert(self, derivative: Derivative) -> Derivative:
+        try:
+            with self.db.begin_nested():
+                self.db.add(derivative)
+        except IntegrityError:
+            # 同一图片的同一衍生图被并发写入，用已有的那一行
+            derivative = self.db.query(Derivative).filter(
+                Derivative.image_id == derivative.image_id,
+                Derivative.spec_hash == derivative.spec_hash).first()
+            if derivative is None:
+                # 图片在渲染期间被删除
+                raise ValueError("Image not found")
+        self.db.commit()
+        return derivative
+
+    def purge_image(self, image_id: int) -> list:
+        """删除图片的全部衍生图记录（不提交），返回提交后可以删除的文件（没有其他图片在用）"""
+        paths = {path for (path,) in self.db.query(Derivative.file_path)
+                 .filter(Derivative.image_id == image_id)}
+        self.db.query(Derivative).filter(Derivative.image_id == image_id) \
+            .delete(synchronize_session=False)
+        shared = {path for (path,) in self.db.query(Derivative.file_path)
+                  .filter(Derivative.file_path.in_(paths))} if paths else set()
+        return sorted(paths - shared)
+
+    def _account(self, added: int):
+        global _approx_bytes
+        if _approx_bytes is None:
+            _approx_bytes = self.collect()
+        else:
+            _approx_bytes += added
+            if _approx_bytes > self.max_bytes:
+                _approx_bytes = self.collect()
+
+    def _files(self):
+        # 同一个文件可能被多张图片引用：按文件汇总大小和最近访问时间
+        return self.db.query(
+            Derivative.file_path,
+            func.max(Derivative.file_size),
+            func.max(Derivative.last_accessed_at).label('last_accessed_at')) \
+            .group_by(Derivative.file_path)
+
+    def collect(self) -> int:
+        """超出预算时按最近访问时间淘汰最旧的文件，降到 90% 以下；返回剩余总大小"""
+        total = sum(size or 0 for _, size, _ in self._files())
+        if total <= self.max_bytes:
+            return total
+
+        target = self.max_bytes * 0.9
+        removed = []
+        for path, size, _ in self._files().order_by('last_accessed_at'):
+            if total <= target:
+                break
+            self.db.query(Derivative).filter(Derivative.file_path == path) \
+                .delete(synchronize_session=False)
+            removed.append(path)
+            total -= size or 0
+        self.db.commit()
+        remove_files(removed)
+        return total
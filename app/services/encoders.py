@@ -0,0 +1,150 @@
+import io
+import json
+import os
+
+from PIL import Image as PILImage
+from PIL import features
+
+try:
+    # 旧版 Pillow 没有内置 AVIF，装了 pillow-avif-plugin 时由插件注册
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# 输出格式 -> (Pillow 格式名, 扩展名, MIME 类型)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'png': ('PNG', '.png', 'image/png'),
+    'gif': ('GIF', '.gif', 'image/gif'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'avif': ('AVIF', '.avif', 'image/avif'),
+}
+
+EXTENSION_FORMATS = {
+    '.jpg': 'jpeg',
+    '.jpeg': 'jpeg',
+    '.png': 'png',
+    '.gif': 'gif',
+    '.webp': 'webp',
+    '.avif': 'avif',
+}
+
+# 可以输出动图的格式，其他格式只编码第一帧
+ANIMATED_FORMATS = ('gif', 'webp')
+
+# 各格式的编码参数
+ENCODER_PROFILES = {
+    'jpeg': {'quality': int(os.getenv('JPEG_QUALITY', 85)),
+             'optimize': True, 'progressive': True},
+    'png': {'compress_level': int(os.getenv('PNG_COMPRESS_LEVEL', 6))},
+    'gif': {'optimize': True},
+    'webp': {'quality': int(os.getenv('WEBP_QUALITY', 80)),
+             'method': int(os.getenv('WEBP_METHOD', 4))},
+    'avif': {'quality': int(os.getenv('AVIF_QUALITY', 60)),
+             'speed': int(os.getenv('AVIF_SPEED', 6))},
+}
+
+# Accept 协商时优先选择的现代格式，按体积从小到大
+NEGOTIABLE_FORMATS = ('avif', 'webp')
+
+_supported = None
+
+
+def supported_formats() -> set:
+    """当前 Pillow 能编码的输出格式"""
+    global _supported
+    if _supported is None:
+        PILImage.init()
+        _supported = {name for name, (pil_format, _, _) in OUTPUT_FORMATS.items()
+                      if pil_format in PILImage.SAVE}
+        if 'webp' in _supported and not features.check('webp'):
+            _supported.discard('webp')
+    return _supported
+
+
+def format_from_extension(ext: str) -> str:
+    return EXTENSION_FORMATS.get(ext.lower(), 'jpeg')
+
+
+def _parse_accept(accept_header: str) -> dict:
+    # "image/avif,image/webp;q=0.9,*/*;q=0.8" -> {'image/avif': 1.0, ...}
+    accepted = {}
+    for item in (accept_header or '').split(','):
+        parts = item.strip().split(';')
+        media_type = parts[0].strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type] = q
+    return accepted
+
+
+def negotiate_format(accept_header: str, source_format: str) -> str:
+    """根据 Accept 选择输出格式：客户端明确声明支持 AVIF/WebP 时优先使用，否则保持源格式"""
+    accepted = _parse_accept(accept_header)
+    available = supported_formats()
+    candidates = [name for name in NEGOTIABLE_FORMATS
+                  if name in available and accepted.get(OUTPUT_FORMATS[name][2], 0) > 0]
+    if candidates:
+        return max(candidates, key=lambda name: accepted[OUTPUT_FORMATS[name][2]])
+    return source_format
+
+
+def encoder_signature(output_format: str) -> str:
+    """编码参数的稳定表示，参与衍生图缓存 key，修改编码参数后旧缓存自然失效"""
+    return f"{output_format}:{json.dumps(ENCODER_PROFILES[output_format], sort_keys=True)}"
+
+
+def _prepare(img, output_format: str):
+    # JPEG 不支持透明和调色板，先铺白底转成 RGB
+    if output_format == 'jpeg' and img.mode not in ('RGB', 'L', 'CMYK'):
+        if img.mode in ('RGBA', 'LA') or \
+                (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = PILImage.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return img.convert('RGB')
+    return img
+
+
+def encoder_params(output_format: str, quality: int = None) -> dict:
+    """编码参数；quality 只对有质量参数的格式（JPEG/WebP/AVIF）生效"""
+    params = dict(ENCODER_PROFILES[output_format])
+    if quality is not None and 'quality' in params:
+        params['quality'] = quality
+    return params
+
+
+def encode(img, output_format: str, quality: int = None) -> bytes:
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    buffer = io.BytesIO()
+    _prepare(img, output_format).save(
+        buffer, format=pil_format, **encoder_params(output_format, quality))
+    return buffer.getvalue()
+
+
+def encode_animation(frames: list, output_format: str, durations: list, loop: int = None,
+                     disposal: list = None, quality: int = None) -> bytes:
+    """把变换后的帧编码成动图；durations 为每帧毫秒数，loop 为 None 表示只播放一次"""
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    params = dict(encoder_params(output_format, quality), save_all=True,
+                  append_images=frames[1:], duration=durations)
+    if output_format == 'gif':
+        if loop is not None:
+            params['loop'] = loop
+        if disposal is not None:
+            params['disposal'] = disposal
+    else:
+        # WebP 的 loop=0 表示无限循环，没有循环扩展的 GIF 只播放一次
+        params['loop'] = 1 if loop is None else loop
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format=pil_format, **params)
+    return buffer.getvalue()
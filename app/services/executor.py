@@ -0,0 +1,162 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import ServiceUnavailable
+
+# 进程池大小，默认等于 CPU 核数；0 表示在当前线程内直接执行
+TRANSFORM_EXECUTOR_WORKERS = int(
+    os.getenv('TRANSFORM_EXECUTOR_WORKERS', os.cpu_count() or 1))
+# 除正在执行的任务外，最多还能排队多少个
+TRANSFORM_EXECUTOR_QUEUE_SIZE = int(
+    os.getenv('TRANSFORM_EXECUTOR_QUEUE_SIZE', 2 * TRANSFORM_EXECUTOR_WORKERS))
+TRANSFORM_EXECUTOR_RETRY_AFTER = int(
+    os.getenv('TRANSFORM_EXECUTOR_RETRY_AFTER', 1))
+# 批量接口在进程池被其他请求占满时最多等待的秒数
+TRANSFORM_EXECUTOR_BATCH_WAIT = float(
+    os.getenv('TRANSFORM_EXECUTOR_BATCH_WAIT', 30))
+
+
+class ExecutorBusy(ServiceUnavailable):
+    """提交队列已满，直接以 503 + Retry-After 返回给客户端"""
+
+    def __init__(self, retry_after: int = TRANSFORM_EXECUTOR_RETRY_AFTER):
+        super().__init__('Image processing is at capacity, please retry later',
+                         retry_after=retry_after)
+
+
+def open_source(source):
+    """在子进程中打开输入：文件路径或内存中的字节；返回 (文件对象, 清理函数)。
+    提交到进程池的都是文件路径，子进程自己读文件，不 pickle 像素或文件内容"""
+    if isinstance(source, (bytes, bytearray)):
+        stream = io.BytesIO(source)
+        return stream, stream.close
+    stream = open(source, 'rb')
+    return stream, stream.close
+
+
+class TransformExecutor:
+    """共享的进程池：解码/变换/编码在子进程里执行，提交数量有上限，满了抛 ExecutorBusy"""
+
+    def __init__(self, max_workers: int = TRANSFORM_EXECUTOR_WORKERS,
+                 queue_size: int = TRANSFORM_EXECUTOR_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1) + queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy()
+
+        if self.max_workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+            return future
+
+        try:
+            future = self._get_pool().submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # 子进程被 OOM kill 等情况下进程池会失效，重建一次
+            self._reset_pool()
+            try:
+                future = self._get_pool().submit(fn, *args, **kwargs)
+            except Exception:
+                self._slots.release()
+                raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def imap_unordered(self, fn, arg_list: list, window: int = None,
+                       busy_timeout: float = TRANSFORM_EXECUTOR_BATCH_WAIT):
+        """批量提交：按完成顺序产出 (序号, 结果或异常)。同时在执行的最多 window 个（默认为进程数），
+        提交队列已满时先等自己已提交的任务完成；一个都没有在执行时最多等 busy_timeout 秒，
+        仍然提交不了的那一项得到 ExecutorBusy"""
+        window = window or max(self.max_workers, 1)
+        pending = {}
+        next_index = 0
+        busy_since = None
+        while next_index < len(arg_list) or pending:
+            while next_index < len(arg_list) and len(pending) < window:
+                try:
+                    future = self.submit(fn, *arg_list[next_index])
+                except ExecutorBusy as e:
+                    if pending:
+                        break
+                    busy_since = busy_since or time.monotonic()
+                    if time.monotonic() - busy_since >= busy_timeout:
+                        yield next_index, e
+                        next_index += 1
+                        busy_since = None
+                    else:
+                        time.sleep(TRANSFORM_EXECUTOR_RETRY_AFTER)
+                    continue
+                except Exception as e:
+                    yield next_index, e
+                    next_index += 1
+                    continue
+                busy_since = None
+                pending[future] = next_index
+                next_index += 1
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield index, future.result()
+                except Exception as e:
+                    yield index, e
+
+    def shutdown(self):
+        self._reset_pool()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> TransformExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = TransformExecutor()
+        return _executor
+
+
+def configure_executor(max_workers: int, queue_size: int = None):
+    """替换进程内共享的 executor，例如 job worker 进程本身已经是一核一个，就用 max_workers=0 直接执行"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = TransformExecutor(
+            max_workers,
+            TRANSFORM_EXECUTOR_QUEUE_SIZE if queue_size is None else queue_size)
+        return _executor
@@ -0,0 +1,158 @@
+from PIL import Image as PILImage
+from PIL import ImageFilter
+
+# 颜色滤镜都表示成 3x4 仿射矩阵（按行：R、G、B 各 4 个系数，最后一个是偏移），
+# 连续的颜色滤镜先把矩阵相乘，最后只用一次 Image.convert(matrix) 完成
+IDENTITY = (1, 0, 0, 0,
+            0, 1, 0, 0,
+            0, 0, 1, 0)
+
+GRAYSCALE = (0.299, 0.587, 0.114, 0,
+             0.299, 0.587, 0.114, 0,
+             0.299, 0.587, 0.114, 0)
+
+SEPIA = (0.393, 0.769, 0.189, 0,
+         0.349, 0.686, 0.168, 0,
+         0.272, 0.534, 0.131, 0)
+
+COLOR_FILTERS = ('grayscale', 'sepia', 'brightness', 'contrast')
+SPATIAL_FILTERS = ('blur', 'sharpen')
+
+
+def _brightness(factor: float):
+    return (factor, 0, 0, 0,
+            0, factor, 0, 0,
+            0, 0, factor, 0)
+
+
+def _contrast(factor: float):
+    # 以 128 为中心拉伸：out = factor * (x - 128) + 128
+    offset = 128 * (1 - factor)
+    return (factor, 0, 0, offset,
+            0, factor, 0, offset,
+            0, 0, factor, offset)
+
+
+def compose(second, first):
+    """返回先做 first 再做 second 的矩阵"""
+    result = []
+    for row in range(3):
+        s = second[row * 4:row * 4 + 4]
+        for col in range(4):
+            value = sum(s[k] * first[k * 4 + col] for k in range(3))
+            if col == 3:
+                value += s[3]
+            result.append(value)
+    return tuple(result)
+
+
+def _color_matrix(name: str, value):
+    if name == 'grayscale':
+        return GRAYSCALE if value else None
+    if name == 'sepia':
+        return SEPIA if value else None
+    if name == 'brightness':
+        return _brightness(float(value))
+    if name == 'contrast':
+        return _contrast(float(value))
+    return None
+
+
+class ColorMatrix:
+    def __init__(self, matrix=IDENTITY):
+        self.matrix = matrix
+
+    def then(self, matrix):
+        return ColorMatrix(compose(matrix, self.matrix))
+
+    def apply(self, img):
+        alpha = None
+        if img.mode in ('RGBA', 'LA', 'PA') or \
+                (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            alpha = img.getchannel('A')
+            img = img.convert('RGB')
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        m = self.matrix
+        # 三行系数相同（例如只做灰度）时直接输出单通道，编码体积也更小
+        if m[0:4] == m[4:8] == m[8:12]:
+            out = img.convert('L', m[0:4])
+            if alpha is not None:
+                out = PILImage.merge('LA', (out, alpha))
+            return out
+
+        out = img.convert('RGB', m)
+        if alpha is not None:
+            out.putalpha(alpha)
+        return out
+
+
+class SpatialFilter:
+    def __init__(self, name: str, value):
+        self.name = name
+        self.value = value
+
+    def apply(self, img):
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        if self.name == 'blur':
+            return img.filter(ImageFilter.GaussianBlur(float(self.value)))
+        # sharpen: True 使用默认强度，数字表示强度倍数（1.0 = 100%）
+        percent = 150 if self.value is True else int(float(self.value) * 100)
+        return img.filter(ImageFilter.UnsharpMask(radius=2, percent=percent, threshold=3))
+
+
+class FilterChain:
+    """按顺序执行的滤镜；相邻的颜色滤镜合并为一次矩阵变换"""
+
+    def __init__(self, stages: list):
+        self.stages = stages
+
+    @classmethod
+    def compile(cls, filters: dict):
+        stages = []
+        for name, value in filters.items():
+            if name in COLOR_FILTERS:
+                matrix = _color_matrix(name, value)
+                if matrix is None:
+                    continue
+                if stages and isinstance(stages[-1], ColorMatrix):
+                    stages[-1] = stages[-1].then(matrix)
+                else:
+                    stages.append(ColorMatrix(matrix))
+            elif name in SPATIAL_FILTERS and value:
+                stages.append(SpatialFilter(name, value))
+        return cls(stages)
+
+    @property
+    def color_only(self) -> bool:
+        return all(isinstance(stage, ColorMatrix) for stage in self.stages)
+
+    def apply(self, img):
+        for stage in self.stages:
+            img = stage.apply(img)
+        return img
+
+
+def validate_filters(filters) -> bool:
+    if not isinstance(filters, dict):
+        return False
+    for name, value in filters.items():
+        if name in ('grayscale', 'sepia'):
+            if not isinstance(value, bool):
+                return False
+        elif name in ('brightness', 'contrast'):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return False
+        elif name == 'blur':
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                return False
+        elif name == 'sharpen':
+            if not isinstance(value, bool) and \
+                    (not isinstance(value, (int, float)) or value <= 0):
+                return False
+        else:
+            return False
+    return True
@@ -1,12 +1,59 @@
+import base64
+import math
 import os
-from PIL import Image as PILImage
+from datetime import datetime
+import time
+from sqlalchemy import func, tuple_
+from werkzeug.exceptions import BadRequest, HTTPException
 
 from app.models.image import Image
+from app.services.blob_store import BlobService, remove_files
 from app.services.cache import RedisCache
+from app.services.coalesce import RequestCoalescer
+from app.services.derivative_cache import DerivativeCache, derivative_key
+from app.services.encoders import OUTPUT_FORMATS, encoder_signature, \
+    format_from_extension, supported_formats
+from app.services.executor import get_executor
+from app.services.filters import validate_filters
+from app.services.metadata import METADATA_FIELDS
+from app.services.metrics import IMAGE_BYTES, TRANSFORM_SECONDS, TRANSFORM_STAGE_SECONDS, \
+    cache_hit, cache_miss
+from app.services.pipeline import DEFAULT_RESIZE_FIT, DEFAULT_RESIZE_MODE, \
+    DEFAULT_ROTATE_RESAMPLE, RESIZE_FITS, RESIZE_MODES, ROTATE_RESAMPLES, crop_in_bounds, \
+    render_image, render_presets
+from app.services.presets import IMAGE_PRESETS, preset_transformations
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# 批量转换一次最多的图片数
+BATCH_TRANSFORM_MAX_ITEMS = int(os.getenv('BATCH_TRANSFORM_MAX_ITEMS', 500))
+
+# 列表只加载这些列，不构造完整的 ORM 对象
+LIST_COLUMNS = (Image.id, Image.filename, Image.storage_name, Image.file_path,
+                Image.file_size, Image.mime_type, Image.content_hash, Image.width,
+                Image.height, Image.image_format, Image.color_mode, Image.frame_count,
+                Image.orientation, Image.placeholder, Image.created_at, Image.updated_at)
+ORIENTATIONS = ('landscape', 'portrait', 'square')
+
+
+def encode_cursor(created_at: datetime, image_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{image_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, image_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(image_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
 
 class ImageListService:
     def __init__(self, db):
         self.db = db
+        self.blobs = BlobService(db)
 
     def create_image(self, image: Image):
         self.db.add(image)
@@ -14,200 +61,365 @@ class ImageListService:
         self.db.refresh(image)
         return image
 
-    def get_image_by_user_id(self, user_id: int):
-        return self.db.query(Image).filter(Image.user_id == user_id).all()
+    def add_images(self, images: list):
+        """批量插入，不提交（由调用方和 blob 引用一起提交）：一次 flush 写入所有行并取得 id。
+        支持 INSERT ... RETURNING 的数据库（SQLite、PostgreSQL、MariaDB）上合并为多行 INSERT；
+        MySQL 没有 RETURNING，要逐行取自增 id，仍是每行一条 INSERT，只是整批只提交一次"""
+        self.db.add_all(images)
+        self.db.flush()
+        return images
+
+    def get_image_by_user_id(self, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                             cursor: str = None, mime_type: str = None,
+                             created_after: datetime = None,
+                             created_before: datetime = None,
+                             orientation: str = None):
+        """按 (created_at, id) 倒序的 keyset 分页，只查询列表需要的列；返回 (rows, next_cursor)"""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = self.db.query(*LIST_COLUMNS).filter(Image.user_id == user_id)
+        if mime_type:
+            query = query.filter(Image.mime_type == mime_type)
+        if created_after:
+            query = query.filter(Image.created_at >= created_after)
+        if created_before:
+            query = query.filter(Image.created_at < created_before)
+        if orientation:
+            if orientation not in ORIENTATIONS:
+                raise ValueError(f"Invalid orientation: {orientation}")
+            query = query.filter({'landscape': Image.width > Image.height,
+                                  'portrait': Image.width < Image.height,
+                                  'square': Image.width == Image.height}[orientation])
+        if cursor:
+            query = query.filter(
+                tuple_(Image.created_at, Image.id) < decode_cursor(cursor))
+
+        # 多取一条用来判断是否还有下一页
+        rows = query.order_by(Image.created_at.desc(), Image.id.desc()) \
+            .limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return rows, next_cursor
+
+    def get_storage_used(self, user_id: int) -> int:
+        """用户已占用的存储字节数，用于配额检查"""
+        return self.db.query(func.coalesce(func.sum(Image.file_size), 0)) \
+            .filter(Image.user_id == user_id).scalar()
 
     def allowed_file(self, filename):
-        ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+        ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
         return '.' in filename and \
             filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
 class ImageService:
-    def __init__(self, db):
+    def __init__(self, db, derivatives: DerivativeCache = None):
         self.db = db
+        self.derivatives = derivatives or DerivativeCache(db)
+        self.blobs = BlobService(db)
 
     def get_image_by_id(self, image_id: int):
         return self.db.query(Image).filter(Image.id == image_id).first()
 
+    def get_images_by_ids(self, image_ids: list, user_id: int) -> dict:
+        """一次查询取出用户名下的多张图片，返回 {id: 图片记录}"""
+        if not image_ids:
+            return {}
+        images = self.db.query(Image).filter(Image.id.in_(set(image_ids)),
+                                             Image.user_id == user_id)
+        return {image.id: image for image in images}
+
     def update_image(self, image_id: int, new_image: Image):
         db_image = self.get_image_by_id(image_id)
         if db_image:
+            # 源文件变了，旧的衍生图全部失效
+            unused_paths = self.derivatives.purge_image(image_id)
             db_image.filename = new_image.filename
             db_image.storage_name = new_image.storage_name
             db_image.file_path = new_image.file_path
             db_image.file_size = new_image.file_size
             db_image.mime_type = new_image.mime_type
+            db_image.content_hash = new_image.content_hash
+            for field in METADATA_FIELDS:
+                setattr(db_image, field, getattr(new_image, field))
+            # new_image 的 blob 引用由调用方获取，这里释放旧的引用（即使是同一个 blob，
+            # 计数也是先加后减），最后一个引用消失时才删除文件；
+            # 先让记录指向新的 blob 再释放，否则删除旧 blob 时违反外键约束
+            old_blob_id = db_image.blob_id
+            db_image.blob_id = new_image.blob_id
+            self.db.flush()
+            if old_blob_id:
+                unused_paths.append(self.blobs.release(old_blob_id))
             self.db.commit()
+            remove_files(unused_paths)
             return db_image.to_dict()
         return None
 
     def delete_image(self, image_id: int):
         image = self.get_image_by_id(image_id)
         if image:
+            unused_paths = self.derivatives.purge_image(image_id)
+            blob_id, file_path = image.blob_id, image.file_path
+            # 先删除记录再释放 blob，否则删除 blob 时 images.blob_id 仍引用它，违反外键约束
             self.db.delete(image)
+            self.db.flush()
+            # 旧数据的文件为记录独占；blob 中的文件只有最后一个引用删除时才删除
+            unused_paths.append(self.blobs.release(blob_id) if blob_id else file_path)
             self.db.commit()
-            # 还需要删除文件夹中的图片
-            os.remove(image.file_path)
+            remove_files(unused_paths)
             return True
         return False
 
 
 class ImageTransformService:
+    """转换不修改原图记录：每个结果作为衍生图保存，总是从原图一次渲染得到"""
+
     def __init__(self, db):
         self.db = db
-        self.image_service = ImageService(self.db)
         self.cache = RedisCache()
+        self.derivatives = DerivativeCache(self.db, self.cache)
+        self.coalescer = RequestCoalescer(self.cache)
+        self.image_service = ImageService(self.db, self.derivatives)
+
+    def content_hash(self, image: Image) -> str:
+        # 上传时已经算好的内容哈希直接用；旧记录没有时再读文件计算（结果按 mtime 缓存）
+        return image.content_hash or self.derivatives.source_hash(image.file_path)
+
+    def derivative_key_for(self, image: Image, transformations: dict, output_format: str) -> str:
+        """衍生图的 key：源文件内容哈希 + 规范化的变换参数 + 输出格式及编码参数"""
+        return derivative_key(self.content_hash(image), transformations,
+                              encoder_signature(output_format))
+
+    def preset_key(self, image: Image, name: str) -> str:
+        source_format = format_from_extension(os.path.splitext(image.storage_name)[1])
+        return self.derivative_key_for(image, preset_transformations(name), source_format)
+
+    def get_preset(self, image: Image, name: str):
+        """返回预设尺寸的衍生图，还没有生成时按需生成"""
+        derivative = self.derivatives.lookup(image.id, self.preset_key(image, name))
+        if derivative is None:
+            self.generate_presets(image.id, [name])
+            derivative = self.derivatives.lookup(image.id, self.preset_key(image, name))
+        return derivative
+
+    def generate_presets(self, image_id: int, names: list = None) -> dict:
+        """生成预设尺寸（默认全部），已有的跳过；返回 {预设名: 衍生图 key}"""
+        image = self.image_service.get_image_by_id(image_id)
+        if not image:
+            raise ValueError("Image not found")
+        names = list(names or IMAGE_PRESETS)
+        ext = os.path.splitext(image.storage_name)[1]
+        output_format = format_from_extension(ext)
+        keys = {name: self.preset_key(image, name) for name in names}
+
+        def render(missing):
+            # 一次解码，逐级缩小生成所有缺失的尺寸
+            results = get_executor().run(
+                render_presets, image.file_path,
+                [(name, preset_transformations(name)['resize']) for name in missing],
+                output_format)
+            for name, data, metadata in results:
+                self.derivatives.store(image_id, keys[name], data, ext, metadata,
+                                       OUTPUT_FORMATS[output_format][2])
+                IMAGE_BYTES.inc(len(data), direction='out', path='presets')
+            return True
 
-    def process_image(self, image_id: int, transformations: dict):
-        # 缓存
-        cache_key = f"image_transform_{image_id}"
-        cached_result = self.cache.get(cache_key)
-        if cached_result:
-            return cached_result
-        
-        for transformation, params in transformations.items():
-            if transformation == 'resize':
-                result = self.resize_image(image_id, params)
-            elif transformation == 'crop':
-                result = self.crop_image(image_id, params)
-            elif transformation == 'rotate':
-                result = self.rotate_image(image_id, params)
-            elif transformation == 'flip':
-                result = self.flip_image(image_id, params)
-
-        self.cache.set(cache_key, result, expire=60 * 60 * 24)
+        # 上传后的后台任务和首次访问可能同时触发：按图片 + 源内容合并，后到的请求等待正在进行的生成；
+        # 等到的结果里没有自己要的尺寸时再生成一次（最多两轮）
+        coalesce_key = f"presets:{image_id}:{self.content_hash(image)}"
+        for _ in range(2):
+            missing = self._missing_presets(image_id, names, keys)
+            if not missing:
+                break
+            with TRANSFORM_SECONDS.time(op='presets', format=output_format, cache='miss'):
+                self.coalescer.run(coalesce_key, lambda: render(missing))
+        return keys
+
+    def _missing_presets(self, image_id: int, names: list, keys: dict) -> list:
+        """还没有生成的预设；内容相同的其他图片已经生成过的直接复用文件"""
+        missing = []
+        for name in sorted(names):
+            if self.derivatives.lookup(image_id, keys[name]) is not None:
+                continue
+            existing = self.derivatives.find(keys[name])
+            if existing is not None:
+                self.derivatives.link(image_id, existing)
+            else:
+                missing.append(name)
+        return missing
+
+    def process_image(self, image_id: int, transformations: dict, output_format: str = None):
+        return self._render(image_id, transformations, 'process', output_format)
+
+    def render(self, image_id: int, transformations: dict, output_format: str = None):
+        """GET 渲染接口按需渲染，返回衍生图记录"""
+        result = self._render(image_id, transformations, 'render', output_format)
+        return self.derivatives.lookup(image_id, result['derivative_key'])
+
+    def _render(self, image_id: int, transformations: dict, op: str,
+                output_format: str = None):
+        start = time.perf_counter()
+        with TRANSFORM_STAGE_SECONDS.time(stage='db_lookup', op=op, format=''):
+            image_record = self.image_service.get_image_by_id(image_id)
+        if not image_record:
+            raise ValueError("Image not found")
+
+        output_format, ext = self._output_format(image_record, transformations, output_format)
+
+        with TRANSFORM_STAGE_SECONDS.time(stage='source_hash', op=op, format=output_format):
+            key = self.derivative_key_for(image_record, transformations, output_format)
+
+        # 已经生成过：只是一次索引查询
+        with TRANSFORM_STAGE_SECONDS.time(stage='cache_lookup', op=op, format=output_format):
+            derivative = self.derivatives.lookup(image_id, key)
+        if derivative is not None:
+            cache_hit('derivative')
+            # 命中也计入端到端耗时，分位数才能反映缓存的效果
+            TRANSFORM_SECONDS.observe(time.perf_counter() - start, op=op, format=output_format,
+                                      cache='hit')
+            return derivative.to_dict()
+
+        # 相同源图 + 相同参数的并发请求只渲染一次，其余请求直接拿到同一个结果
+        result = self.coalescer.run(
+            f"render:{image_id}:{key}",
+            lambda: self._render_and_store(image_record, transformations, key,
+                                           output_format, ext, op))
+        TRANSFORM_SECONDS.observe(time.perf_counter() - start, op=op, format=output_format,
+                                  cache='miss')
         return result
 
+    @staticmethod
+    def _output_format(image_record: Image, transformations: dict, output_format: str = None):
+        """输出格式：transformations 中显式指定 > Accept 协商结果 > 源格式；返回 (格式, 扩展名)"""
+        ext = os.path.splitext(image_record.storage_name)[1]
+        source_format = format_from_extension(ext)
+        output_format = (transformations.get('format')
+                         or output_format or source_format).lower()
+        if output_format != source_format:
+            ext = OUTPUT_FORMATS[output_format][1]
+        return output_format, ext
+
+    def render_batch(self, items: list):
+        """批量渲染，items 为 (图片记录, transformations, output_format)，按完成顺序产出 (序号, 结果或异常)。
+        已有的衍生图先返回；需要渲染的去重后一起提交到进程池，数据库读写都在调用方线程中完成"""
+        op = 'batch'
+        renders = []
+        # 衍生图 key -> 等待同一个渲染结果的 (序号, 图片 id)
+        waiting = {}
+        for index, (image_record, transformations, output_format) in enumerate(items):
+            try:
+                output_format, ext = self._output_format(image_record, transformations,
+                                                         output_format)
+                key = self.derivative_key_for(image_record, transformations, output_format)
+                if key in waiting:
+                    waiting[key].append((index, image_record.id))
+                    continue
+                derivative = self.derivatives.lookup(image_record.id, key)
+                if derivative is not None:
+                    cache_hit('derivative')
+                else:
+                    derivative = self._link_existing(image_record.id, key, op, output_format)
+                if derivative is not None:
+                    yield index, derivative.to_dict()
+                    continue
+            except Exception as e:
+                yield index, e
+                continue
+            cache_miss('derivative')
+            waiting[key] = []
+            renders.append((index, image_record, transformations, key, output_format, ext))
+
+        start = time.perf_counter()
+        outcomes = get_executor().imap_unordered(
+            render_image, [(image_record.file_path, transformations, output_format)
+                           for _, image_record, transformations, _, output_format, _ in renders])
+        for n, outcome in outcomes:
+            index, image_record, _, key, output_format, ext = renders[n]
+            if not isinstance(outcome, Exception):
+                try:
+                    derivative = self._store_rendered(image_record, key, output_format, ext,
+                                                      outcome, op)
+                    outcome = derivative.to_dict()
+                except Exception as e:
+                    outcome = e
+            yield index, outcome
+            # 内容相同的其他图片共用这一次渲染的文件
+            for other_index, other_image_id in waiting[key]:
+                if isinstance(outcome, Exception):
+                    yield other_index, outcome
+                    continue
+                try:
+                    yield other_index, self.derivatives.link(other_image_id, derivative).to_dict()
+                except Exception as e:
+                    yield other_index, e
+        if renders:
+            TRANSFORM_SECONDS.observe(time.perf_counter() - start, op=op, format='', cache='miss')
+
+    def _render_and_store(self, image_record: Image, transformations: dict, key: str,
+                          output_format: str, ext: str, op: str = 'process'):
+        derivative = self._link_existing(image_record.id, key, op, output_format)
+        if derivative is not None:
+            return derivative.to_dict()
+
+        cache_miss('derivative')
+        # 总是从原图渲染；解码/变换/编码放到共享进程池执行，子进程自己读源文件，不传像素
+        rendered = get_executor().run(
+            render_image, image_record.file_path, transformations, output_format)
+        return self._store_rendered(image_record, key, output_format, ext, rendered,
+                                    op).to_dict()
+
+    def _link_existing(self, image_id: int, key: str, op: str, output_format: str):
+        """内容相同的其他图片已经渲染过同样的参数：复用文件，不再解码/编码；没有时返回 None"""
+        existing = self.derivatives.find(key)
+        if existing is None:
+            return None
+        cache_hit('derivative')
+        with TRANSFORM_STAGE_SECONDS.time(stage='commit', op=op, format=output_format):
+            return self.derivatives.link(image_id, existing)
+
+    def _store_rendered(self, image_record: Image, key: str, output_format: str, ext: str,
+                        rendered: tuple, op: str):
+        """记录 render_image 返回的各阶段耗时和字节数，把结果写成衍生图"""
+        data, timings, metadata = rendered
+        stage = TRANSFORM_STAGE_SECONDS
+        for name, seconds in timings.items():
+            stage.observe(seconds, stage=name, op=op, format=output_format)
+        IMAGE_BYTES.inc(image_record.file_size or 0, direction='in', path='transform')
+        IMAGE_BYTES.inc(len(data), direction='out', path='transform')
+        with stage.time(stage='write', op=op, format=output_format):
+            return self.derivatives.store(image_record.id, key, data, ext, metadata,
+                                          OUTPUT_FORMATS[output_format][2])
+
     def resize_image(self, image_id: int, params: dict):
-        try:
-            # 获取原始图片信息
-            image_record = self.image_service.get_image_by_id(image_id)
-            if not image_record:
-                raise ValueError("Image not found")
-
-            with PILImage.open(image_record.file_path) as img:
-                resized_img = img.resize(
-                    (params['width'], params['height']),
-                    PILImage.Resampling.LANCZOS
-                )
-
-                new_filename = f"resized_{image_record.storage_name}"
-                new_path = os.path.join(os.path.dirname(
-                    image_record.file_path), new_filename)
-                resized_img.save(new_path, quality=95)
-
-                return self.image_service.update_image(
-                    image_id,
-                    Image(
-                        filename=f"rotate_{image_record.filename}",
-                        storage_name=new_filename,
-                        file_path=new_path,
-                        file_size=os.path.getsize(new_path),
-                        mime_type=image_record.mime_type
-                    )
-                )
-        except Exception as e:
-            raise Exception(f"Resize failed: {str(e)}")
+        return self._render_single(image_id, 'resize', params)
 
     def crop_image(self, image_id: int, params: dict):
-        try:
-            image_record = self.image_service.get_image_by_id(image_id)
-            if not image_record:
-                raise ValueError("Image not found")
-
-            with PILImage.open(image_record.file_path) as img:
-                cropped_img = img.crop(
-                    (params['x'], params['y'], params['x'] + params['width'], params['y'] + params['height']))
-                new_filename = f"cropped_{image_record.storage_name}"
-                new_path = os.path.join(os.path.dirname(
-                    image_record.file_path), new_filename)
-                cropped_img.save(new_path, quality=95)
-
-                return self.image_service.update_image(
-                    image_id,
-                    Image(
-                        filename=f"cropped_{image_record.filename}",
-                        storage_name=new_filename,
-                        file_path=new_path,
-                        file_size=os.path.getsize(new_path),
-                        mime_type=image_record.mime_type
-                    )
-                )
-        except Exception as e:
-            raise Exception(f"Crop failed: {str(e)}")
+        return self._render_single(image_id, 'crop', params)
 
     def rotate_image(self, image_id: int, params: dict):
-        try:
-            image_record = self.image_service.get_image_by_id(image_id)
-            if not image_record:
-                raise ValueError("Image not found")
-
-            with PILImage.open(image_record.file_path) as img:
-                # 根据方向翻转图片
-                if params.get('direction') == 'horizontal':
-                    flipped_img = img.transpose(
-                        PILImage.Transpose.FLIP_LEFT_RIGHT)
-                else:  # vertical
-                    flipped_img = img.transpose(
-                        PILImage.Transpose.FLIP_TOP_BOTTOM)
-
-                # 保存处理后的图片
-                new_filename = f"rotate_{image_record.storage_name}"
-                new_path = os.path.join(os.path.dirname(
-                    image_record.file_path), new_filename)
-                flipped_img.save(new_path, quality=95)
-                new_image = Image(
-                    filename=f"rotate_{image_record.filename}",
-                    storage_name=new_filename,
-                    file_path=new_path,
-                    file_size=os.path.getsize(new_path),
-                    mime_type=image_record.mime_type
-                )
-                return self.image_service.update_image(
-                    image_id,
-                    new_image
-                )
-        except Exception as e:
-            raise Exception(f"Rotate failed: {str(e)}")
+        return self._render_single(image_id, 'rotate', params)
 
     def flip_image(self, image_id: int, params: dict):
+        return self._render_single(image_id, 'flip', params)
+
+    def _render_single(self, image_id: int, op: str, params: dict):
+        # 参数不合法时返回 400，不要在渲染时变成 KeyError 和 500
+        if not self.validate_transformations({op: params}):
+            raise BadRequest('Invalid transformation parameters')
         try:
-            image_record = self.image_service.get_image_by_id(image_id)
-            if not image_record:
-                raise ValueError("Image not found")
-
-            with PILImage.open(image_record.file_path) as img:
-                # 根据方向翻转图片
-                if params.get('direction') == 'horizontal':
-                    flipped_img = img.transpose(
-                        PILImage.Transpose.FLIP_LEFT_RIGHT)
-                else:  # vertical
-                    flipped_img = img.transpose(
-                        PILImage.Transpose.FLIP_TOP_BOTTOM)
-
-                # 保存处理后的图片
-                new_filename = f"flipped_{image_record.storage_name}"
-                new_path = os.path.join(os.path.dirname(
-                    image_record.file_path), new_filename)
-                flipped_img.save(new_path, quality=95)
-
-                return self.image_service.update_image(
-                    image_id,
-                    Image(
-                        filename=f"flipped_{image_record.filename}",
-                        storage_name=new_filename,
-                        file_path=new_path,
-                        file_size=os.path.getsize(new_path),
-                        mime_type=image_record.mime_type
-                    )
-                )
+            return self._render(image_id, {op: params}, op)
+        except HTTPException:
+            # ExecutorBusy(503)、ImageOverBudget(422)、ImageTooLarge(413) 保留状态码
+            raise
         except Exception as e:
-            raise Exception(f"Flip failed: {str(e)}")
+            raise Exception(f"{op.capitalize()} failed: {str(e)}")
 
-    def validate_transformations(self, transformations):
-        """验证转换参数的格式和值"""
-        allowed_transforms = {'resize', 'crop', 'rotate', 'format', 'filters'}
+    def validate_transformations(self, transformations, image: Image = None):
+        """验证转换参数的格式和值；传入 image 且已知尺寸时，同时检查裁剪区域
+        不超出前面的操作执行之后的图片"""
+        allowed_transforms = {'resize', 'crop', 'rotate', 'flip', 'format', 'filters',
+                              'animation', 'quality'}
         if not all(k in allowed_transforms for k in transformations.keys()):
             return False
 
@@ -216,7 +428,10 @@ class ImageTransformService:
             resize = transformations['resize']
             if not isinstance(resize, dict) or \
                not all(k in resize for k in ['width', 'height']) or \
-               not all(isinstance(v, (int, float)) for v in resize.values()):
+               not all(isinstance(resize[k], (int, float)) and resize[k] > 0
+                       for k in ['width', 'height']) or \
+               resize.get('mode', DEFAULT_RESIZE_MODE) not in RESIZE_MODES or \
+               resize.get('fit', DEFAULT_RESIZE_FIT) not in RESIZE_FITS:
                 return False
 
         # 验证 crop 参数
@@ -226,23 +441,53 @@ class ImageTransformService:
                not all(k in crop for k in ['width', 'height', 'x', 'y']) or \
                not all(isinstance(v, (int, float)) for v in crop.values()):
                 return False
+            if crop['x'] < 0 or crop['y'] < 0 or crop['width'] <= 0 or crop['height'] <= 0:
+                return False
 
-        # 验证 rotate 参数
+        # 验证 rotate 参数：angle 为顺时针角度，resample 只影响非 90° 倍数的角度
         if 'rotate' in transformations:
-            return True
+            rotate = transformations['rotate']
+            if not isinstance(rotate, dict) or \
+               not isinstance(rotate.get('angle'), (int, float)) or \
+               isinstance(rotate['angle'], bool) or \
+               not math.isfinite(rotate['angle']) or \
+               rotate.get('resample', DEFAULT_ROTATE_RESAMPLE) not in ROTATE_RESAMPLES:
+                return False
+
+        # 验证 flip 参数
+        if 'flip' in transformations:
+            flip = transformations['flip']
+            if not isinstance(flip, dict) or \
+               flip.get('direction', 'vertical') not in ('horizontal', 'vertical'):
+                return False
 
         # 验证 format 参数
         if 'format' in transformations:
             if not isinstance(transformations['format'], str) or \
-               transformations['format'].lower() not in ['jpeg', 'png', 'gif', 'webp']:
+               transformations['format'].lower() not in supported_formats():
+                return False
+
+        # 验证 quality 参数：只对 JPEG/WebP/AVIF 输出生效
+        if 'quality' in transformations:
+            quality = transformations['quality']
+            if not isinstance(quality, int) or isinstance(quality, bool) or \
+               not 1 <= quality <= 100:
+                return False
+
+        # 验证 animation 参数：只对动图生效
+        if 'animation' in transformations:
+            animation = transformations['animation']
+            if not isinstance(animation, dict) or \
+               not all(k in ('dedupe',) for k in animation) or \
+               not all(isinstance(v, bool) for v in animation.values()):
                 return False
 
         # 验证 filters 参数
         if 'filters' in transformations:
-            filters = transformations['filters']
-            if not isinstance(filters, dict) or \
-               not all(k in ['grayscale', 'sepia'] for k in filters.keys()) or \
-               not all(isinstance(v, bool) for v in filters.values()):
+            if not validate_filters(transformations['filters']):
                 return False
 
+        # 所有参数都合法之后才能推算尺寸：crop 前面有 resize/rotate 时按变换后的尺寸检查
+        if 'crop' in transformations and image is not None and image.width and image.height:
+            return crop_in_bounds(transformations, (image.width, image.height))
         return True
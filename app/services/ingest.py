@@ -0,0 +1,247 @@
+import hashlib
+import io
+import os
+from uuid import uuid4
+
+from flask import Request
+from PIL import Image as PILImage
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from app.services.decode import ImageTooLarge, check_pixels
+
+# 单个上传文件的大小上限（字节），同时作为 Flask 的 MAX_CONTENT_LENGTH
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 50 * 1024 * 1024))
+# 每个用户的存储配额（字节），0 表示不限制
+USER_STORAGE_QUOTA = int(os.getenv('USER_STORAGE_QUOTA', 0))
+# 上传过程中的临时文件目录，需要和 uploads 在同一文件系统上才能原子重命名
+UPLOAD_TMP_DIR = os.getenv('UPLOAD_TMP_DIR', os.path.join('uploads', 'tmp'))
+# 用来识别格式和尺寸的头部字节数；头部很大的文件（例如带大段 EXIF 的 JPEG）最多缓冲到 UPLOAD_SNIFF_MAX_BYTES
+UPLOAD_SNIFF_BYTES = int(os.getenv('UPLOAD_SNIFF_BYTES', 64 * 1024))
+UPLOAD_SNIFF_MAX_BYTES = int(os.getenv('UPLOAD_SNIFF_MAX_BYTES', 1024 * 1024))
+# 批量上传：一次最多的文件数和整个请求体的大小上限
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', 100))
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv('BATCH_UPLOAD_MAX_BYTES', 500 * 1024 * 1024))
+
+# 魔数 -> 格式；WebP 还需要检查第 8-12 字节
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'RIFF', 'webp'),
+)
+# 允许上传的格式 -> (PIL 格式名, 存储扩展名, MIME)
+UPLOAD_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'png': ('PNG', '.png', 'image/png'),
+    'gif': ('GIF', '.gif', 'image/gif'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    pass
+
+
+class UnsupportedImage(UnsupportedMediaType):
+    pass
+
+
+def sniff_format(header: bytes):
+    """根据魔数判断格式，无法识别返回 None"""
+    for signature, image_format in SIGNATURES:
+        if header.startswith(signature):
+            if image_format == 'webp' and header[8:12] != b'WEBP':
+                return None
+            return image_format
+    return None
+
+
+def _webp_size(header: bytes):
+    # Pillow 打开 WebP 需要完整文件，这里直接解析 RIFF 中第一个块的头
+    chunk = header[12:16]
+    if chunk == b'VP8X' and len(header) >= 30:
+        return (int.from_bytes(header[24:27], 'little') + 1,
+                int.from_bytes(header[27:30], 'little') + 1)
+    if chunk == b'VP8 ' and len(header) >= 30 and header[23:26] == b'\x9d\x01\x2a':
+        return (int.from_bytes(header[26:28], 'little') & 0x3fff,
+                int.from_bytes(header[28:30], 'little') & 0x3fff)
+    if chunk == b'VP8L' and len(header) >= 25 and header[20] == 0x2f:
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    return None
+
+
+def sniff_size(header: bytes, image_format: str):
+    """只解析头部得到 (宽, 高)，不解码像素；数据还不够时返回 None"""
+    if image_format == 'webp':
+        return _webp_size(header)
+    try:
+        with PILImage.open(io.BytesIO(header), formats=[UPLOAD_FORMATS[image_format][0]]) as img:
+            return img.size
+    except PILImage.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        return None
+
+
+class IngestResult:
+    __slots__ = ('size', 'content_hash', 'format', 'width', 'height')
+
+    def __init__(self, size: int, content_hash: str, image_format: str, width: int, height: int):
+        self.size = size
+        self.content_hash = content_hash
+        self.format = image_format
+        self.width = width
+        self.height = height
+
+    @property
+    def extension(self) -> str:
+        return UPLOAD_FORMATS[self.format][1]
+
+    @property
+    def mime_type(self) -> str:
+        return UPLOAD_FORMATS[self.format][2]
+
+
+class IngestWriter:
+    """werkzeug 解析 multipart 时把文件内容逐块写到这里：边写临时文件边算 SHA-256，
+    第一块到达时就检查魔数，超过大小上限立即中止，不必等整个文件落盘。
+    defer_errors 时（批量上传）不中止整个请求：丢弃这个文件的其余内容，错误在 finish() 时抛出"""
+
+    def __init__(self, limit: int, limit_message: str = None, tmp_dir: str = UPLOAD_TMP_DIR,
+                 defer_errors: bool = False):
+        self.limit = limit
+        self.defer_errors = defer_errors
+        self.error = None
+        self.limit_message = limit_message or f"File exceeds the {limit} byte limit"
+        os.makedirs(tmp_dir, exist_ok=True)
+        self.path = os.path.join(tmp_dir, f".{uuid4().hex}.part")
+        self._file = open(self.path, 'wb')
+        self._hash = hashlib.sha256()
+        self._header = bytearray()
+        self.size = 0
+        self.format = None
+        self.dimensions = None
+        self.committed = False
+
+    def write(self, data) -> int:
+        if self.error is not None:
+            return len(data)
+        try:
+            self.size += len(data)
+            if self.size > self.limit:
+                self.discard()
+                raise UploadTooLarge(self.limit_message)
+            if self.dimensions is None:
+                self._sniff(data)
+        except (UploadTooLarge, UnsupportedImage, ImageTooLarge) as e:
+            if not self.defer_errors:
+                raise
+            self.error = e
+            return len(data)
+        self._hash.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def _sniff(self, data):
+        self._header += data[:UPLOAD_SNIFF_MAX_BYTES - len(self._header)]
+        if self.format is None and len(self._header) >= 12:
+            self.format = sniff_format(bytes(self._header))
+            if self.format is None:
+                self.discard()
+                raise UnsupportedImage("File is not a supported image (jpeg, png, gif, webp)")
+        if self.format is not None and len(self._header) >= UPLOAD_SNIFF_BYTES:
+            self._try_size(final=len(self._header) >= UPLOAD_SNIFF_MAX_BYTES)
+
+    def _try_size(self, final: bool):
+        try:
+            self.dimensions = sniff_size(bytes(self._header), self.format)
+            if self.dimensions is not None:
+                # 像素数超限的图片不必等整个文件上传完
+                check_pixels(*self.dimensions)
+        except ImageTooLarge:
+            self.discard()
+            raise
+        if self.dimensions is None and final:
+            self.discard()
+            raise UnsupportedImage("Could not read image dimensions")
+        if self.dimensions is not None:
+            # 尺寸已经拿到，不再缓冲头部
+            self._header = bytearray()
+
+    def finish(self) -> IngestResult:
+        """上传读完后调用：补做小文件的识别，返回大小、哈希、格式和尺寸"""
+        if self.error is not None:
+            raise self.error
+        self._file.flush()
+        if self.format is None:
+            self.format = sniff_format(bytes(self._header))
+            if self.format is None:
+                self.discard()
+                raise UnsupportedImage("File is not a supported image (jpeg, png, gif, webp)")
+        if self.dimensions is None:
+            self._try_size(final=True)
+        width, height = self.dimensions
+        return IngestResult(self.size, self._hash.hexdigest(), self.format, width, height)
+
+    def commit(self, file_path: str):
+        """原子地移动到最终位置"""
+        self._file.close()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(self.path, file_path)
+        self.committed = True
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # werkzeug 写完后会 seek(0)，请求结束时会 close()；批量上传中出错的文件此时已经关闭
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.size if self._file.closed else self._file.tell()
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self.discard()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+
+class IngestRequest(Request):
+    """设置了 ingest_limit 的请求，上传文件直接流式写入 IngestWriter；其他请求保持默认行为。
+    ingest_max_content_length 在读取请求体之前设置，覆盖这一个请求的请求体大小上限"""
+
+    ingest_limit = None
+    ingest_limit_message = None
+    ingest_defer_errors = False
+    ingest_max_content_length = None
+
+    @property
+    def max_content_length(self):
+        if self.ingest_max_content_length is not None:
+            return self.ingest_max_content_length
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        if self.ingest_limit is None:
+            return super()._get_file_stream(total_content_length, content_type,
+                                            filename, content_length)
+        return IngestWriter(self.ingest_limit, self.ingest_limit_message,
+                            defer_errors=self.ingest_defer_errors)
+
+
+def init_ingest(app):
+    app.request_class = IngestRequest
+    # 请求体超过上限时 werkzeug 直接按 Content-Length 拒绝，不读取请求体
+    app.config.setdefault('MAX_CONTENT_LENGTH', MAX_CONTENT_LENGTH + 64 * 1024)
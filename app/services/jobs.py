@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+
+import redis
+
+from app.services.cache import get_redis_client
+
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'redis')
+JOB_QUEUE_SQLITE_PATH = os.getenv('JOB_QUEUE_SQLITE_PATH', 'jobs.sqlite3')
+# 任务被领取后多久未完成就重新可见（秒）
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 300))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# 任务结果保留时间（秒）
+JOB_RESULT_EXPIRE = int(os.getenv('JOB_RESULT_EXPIRE', 60 * 60 * 24))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+def _retry_delay(attempts: int) -> int:
+    return min(2 ** attempts, 60)
+
+
+def _new_job(job_type: str, payload: dict, user_id=None) -> dict:
+    now = time.time()
+    return {
+        'id': uuid4().hex,
+        'type': job_type,
+        'payload': payload,
+        'user_id': user_id,
+        'status': QUEUED,
+        'attempts': 0,
+        'result': None,
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+class RedisJobQueue:
+    """基于 Redis 的任务队列：jobs:ready 是按可见时间排序的 zset，领取任务时把分数推后 visibility timeout"""
+
+    READY_KEY = 'jobs:ready'
+
+    # 原子地取出一个已到可见时间的任务，并把它的可见时间推后
+    _RESERVE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #ids == 0 then
+    return nil
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ids[1])
+return ids[1]
+"""
+
+    def __init__(self, client: redis.Redis = None,
+                 visibility_timeout: int = JOB_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.client = client or get_redis_client()
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._reserve = self.client.register_script(self._RESERVE_SCRIPT)
+
+    def _save(self, job: dict):
+        job['updated_at'] = time.time()
+        self.client.set(f"jobs:{job['id']}", json.dumps(job),
+                        ex=JOB_RESULT_EXPIRE)
+
+    def enqueue(self, job_type: str, payload: dict, user_id=None) -> str:
+        job = _new_job(job_type, payload, user_id)
+        self._save(job)
+        self.client.zadd(self.READY_KEY, {job['id']: job['created_at']})
+        return job['id']
+
+    def get(self, job_id: str):
+        value = self.client.get(f"jobs:{job_id}")
+        return json.loads(value) if value else None
+
+    def reserve(self):
+        now = time.time()
+        job_id = self._reserve(keys=[self.READY_KEY],
+                               args=[now, now + self.visibility_timeout])
+        if job_id is None:
+            return None
+        job = self.get(job_id.decode())
+        if job is None:
+            self.client.zrem(self.READY_KEY, job_id)
+            return None
+
+        # 超过最大尝试次数（例如 worker 反复崩溃）直接判定失败
+        if job['attempts'] >= self.max_attempts:
+            job['status'] = FAILED
+            job['error'] = job['error'] or 'Visibility timeout exceeded'
+            self._save(job)
+            self.client.zrem(self.READY_KEY, job['id'])
+            return None
+
+        job['status'] = RUNNING
+        job['attempts'] += 1
+        self._save(job)
+        return job
+
+    def complete(self, job_id: str, result):
+        job = self.get(job_id)
+        if job is None:
+            return
+        job['status'] = SUCCEEDED
+        job['result'] = result
+        job['error'] = None
+        self._save(job)
+        self.client.zrem(self.READY_KEY, job_id)
+
+    def fail(self, job_id: str, error: str, retry: bool = True):
+        job = self.get(job_id)
+        if job is None:
+            return
+        job['error'] = error
+        if not retry or job['attempts'] >= self.max_attempts:
+            job['status'] = FAILED
+            self._save(job)
+            self.client.zrem(self.READY_KEY, job_id)
+        else:
+            job['status'] = QUEUED
+            self._save(job)
+            self.client.zadd(self.READY_KEY, {
+                job_id: time.time() + _retry_delay(job['attempts'])})
+
+
+class SQLiteJobQueue:
+    """SQLite 实现，接口与 RedisJobQueue 一致；本地开发和测试时代替 Redis，多个进程可共享同一个文件"""
+
+    def __init__(self, path: str = JOB_QUEUE_SQLITE_PATH,
+                 visibility_timeout: int = JOB_VISIBILITY_TIMEOUT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    user_id INTEGER,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    visible_at REAL NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs (status, visible_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite 连接不能跨线程使用，每个线程一个
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job.pop('visible_at')
+        return job
+
+    def enqueue(self, job_type: str, payload: dict, user_id=None) -> str:
+        job = _new_job(job_type, payload, user_id)
+        self._conn().execute(
+            "INSERT INTO jobs (id, type, payload, user_id, status, attempts, visible_at,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)",
+            (job['id'], job_type, json.dumps(payload), user_id, QUEUED,
+             job['created_at'], job['created_at'], job['created_at']))
+        return job['id']
+
+    def get(self, job_id: str):
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def reserve(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND visible_at <= ?"
+                " ORDER BY visible_at LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row['attempts'] >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = COALESCE(error, ?), updated_at = ?"
+                    " WHERE id = ?",
+                    (FAILED, 'Visibility timeout exceeded', now, row['id']))
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, visible_at = ?,"
+                " updated_at = ? WHERE id = ?",
+                (RUNNING, now + self.visibility_timeout, now, row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row['id'])
+
+    def complete(self, job_id: str, result):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ?"
+            " WHERE id = ?", (SUCCEEDED, json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id: str, error: str, retry: bool = True):
+        job = self.get(job_id)
+        if job is None:
+            return
+        now = time.time()
+        if not retry or job['attempts'] >= self.max_attempts:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED, error, now, job_id))
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, error = ?, visible_at = ?, updated_at = ?"
+                " WHERE id = ?",
+                (QUEUED, error, now + _retry_delay(job['attempts']), now, job_id))
+
+
+_queue = None
+
+
+def get_job_queue():
+    # 进程内共享一个队列实例（及其连接）
+    global _queue
+    if _queue is None:
+        _queue = SQLiteJobQueue() if JOB_QUEUE_BACKEND == 'sqlite' else RedisJobQueue()
+    return _queue
@@ -0,0 +1,72 @@
+import base64
+import io
+import os
+
+from PIL import Image as PILImage
+
+from app.services.decode import RENDER_MEMORY_BUDGET, bitmap_bytes, open_image
+from app.services.executor import open_source
+
+# 占位预览图最长边的像素数
+PLACEHOLDER_SIZE = int(os.getenv('PLACEHOLDER_SIZE', 16))
+EXIF_ORIENTATION = 0x0112
+
+# 上传时解析一次并写入 images 表的字段
+METADATA_FIELDS = ('width', 'height', 'image_format', 'color_mode', 'frame_count',
+                   'orientation', 'placeholder')
+
+
+def read_header(img: PILImage.Image) -> dict:
+    """只用已解析的文件头，不解码像素"""
+    orientation = None
+    if img.format in ('JPEG', 'WEBP', 'PNG', 'TIFF'):
+        orientation = img.getexif().get(EXIF_ORIENTATION)
+    return {
+        'width': img.width,
+        'height': img.height,
+        'image_format': (img.format or '').lower() or None,
+        'color_mode': img.mode,
+        'frame_count': getattr(img, 'n_frames', 1),
+        'orientation': orientation or 1,
+    }
+
+
+def make_placeholder(img: PILImage.Image) -> str:
+    """很小的预览图，以 data URI 返回，列表页可以直接内嵌显示"""
+    preview = img.copy() if img.mode in ('RGB', 'RGBA', 'L', 'LA') else img.convert('RGBA')
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), PILImage.Resampling.BILINEAR,
+                      reducing_gap=2.0)
+    if preview.mode not in ('RGB', 'RGBA'):
+        preview = preview.convert('RGBA' if 'A' in preview.mode else 'RGB')
+    buffer = io.BytesIO()
+    try:
+        preview.save(buffer, format='WEBP', quality=40)
+        mime_type = 'image/webp'
+    except (KeyError, OSError):
+        # Pillow 没有编译 WebP 支持时退回 PNG
+        buffer = io.BytesIO()
+        preview.save(buffer, format='PNG', optimize=True)
+        mime_type = 'image/png'
+    return f"data:{mime_type};base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+
+
+def extract_metadata(source) -> dict:
+    """解析文件头得到尺寸、格式、模式、帧数和 EXIF 方向，再以最小分辨率解码一次生成占位图；
+    作为顶层函数以便在进程池中执行。数据损坏时抛出 Pillow 的异常，像素数超限时抛出 ImageTooLarge"""
+    stream, cleanup = open_source(source)
+    try:
+        with open_image(stream) as img:
+            metadata = read_header(img)
+            if img.format == 'JPEG':
+                # DCT 缩放解码，只解出占位图需要的 1/8 分辨率
+                img.draft('RGB', (PLACEHOLDER_SIZE * 2, PLACEHOLDER_SIZE * 2))
+            img.seek(0)
+            if bitmap_bytes(img.size, img.mode) <= RENDER_MEMORY_BUDGET:
+                img.load()
+                metadata['placeholder'] = make_placeholder(img)
+            else:
+                # 整张解码超出内存预算：不生成占位图，上传照常完成
+                metadata['placeholder'] = None
+            return metadata
+    finally:
+        cleanup()
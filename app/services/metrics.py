@@ -0,0 +1,255 @@
+import bisect
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 按比例对请求做 cProfile 采样（0 表示关闭），耗时超过阈值的请求才把结果写到目录中
+METRICS_PROFILE_SAMPLE_RATE = float(os.getenv('METRICS_PROFILE_SAMPLE_RATE', 0))
+METRICS_PROFILE_THRESHOLD_MS = float(os.getenv('METRICS_PROFILE_THRESHOLD_MS', 1000))
+METRICS_PROFILE_DIR = os.getenv('METRICS_PROFILE_DIR', 'profiles')
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram:
+    """累计分桶直方图；每次 observe 只是一次二分查找和几次加法"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [各桶计数（非累计）..., +Inf 桶计数, sum]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        # 采集时才计算的指标（例如连接池状态），返回 [(name, type, help, [(labels, value)])]
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, metric_type, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ('endpoint', 'method', 'status')))
+TRANSFORM_SECONDS = registry.register(Histogram(
+    'transform_duration_seconds', 'End-to-end transform latency',
+    ('op', 'format', 'cache')))
+TRANSFORM_STAGE_SECONDS = registry.register(Histogram(
+    'transform_stage_duration_seconds', 'Transform latency by stage',
+    ('stage', 'op', 'format')))
+UPLOAD_STAGE_SECONDS = registry.register(Histogram(
+    'upload_stage_duration_seconds', 'Upload latency by stage', ('stage',)))
+AUTH_STAGE_SECONDS = registry.register(Histogram(
+    'auth_stage_duration_seconds', 'login_required latency by stage', ('stage',)))
+REDIS_COMMAND_SECONDS = registry.register(Histogram(
+    'redis_command_duration_seconds', 'Redis command latency', ('command',)))
+CACHE_REQUESTS = registry.register(Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit/miss)',
+    ('cache', 'result')))
+IMAGE_BYTES = registry.register(Counter(
+    'image_bytes_total', 'Image bytes received and produced', ('direction', 'path')))
+
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache=cache, result='hit')
+
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache=cache, result='miss')
+
+
+def render() -> str:
+    return registry.render()
+
+
+def _start_profile():
+    if METRICS_PROFILE_SAMPLE_RATE <= 0 or random.random() >= METRICS_PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一时刻只能有一个 profiler 生效，其他线程正在采样时跳过
+        return None
+    return profiler
+
+
+def _finish_profile(profiler, elapsed: float, name: str):
+    profiler.disable()
+    if elapsed * 1000 < METRICS_PROFILE_THRESHOLD_MS:
+        return
+    os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(METRICS_PROFILE_DIR,
+                        f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-"
+                        f"{name.replace('/', '_')}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    logger.info("Slow request profile written to %s", path)
+
+
+def init_metrics(app):
+    """记录每个请求的耗时；按采样率对请求做 cProfile，慢请求的结果写入 METRICS_PROFILE_DIR"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_profiler = _start_profile()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            elapsed = time.perf_counter() - start
+            endpoint = request.endpoint or 'unknown'
+            HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint,
+                                         method=request.method,
+                                         status=response.status_code)
+            profiler = g.pop('metrics_profiler', None)
+            if profiler is not None:
+                _finish_profile(profiler, elapsed, endpoint)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # 请求异常结束时 after_request 不会执行，确保 profiler 被关闭
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0'):
+    """在后台线程中提供 /metrics，供没有 Flask 的进程（任务 worker）使用"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,132 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+
+from PIL import Image as PILImage
+from PIL import ImageOps, JpegImagePlugin
+
+from app.services.decode import RENDER_MEMORY_BUDGET, bitmap_bytes
+from app.services.encoders import ENCODER_PROFILES, OUTPUT_FORMATS
+from app.services.executor import open_source
+from app.services.metadata import EXIF_ORIENTATION
+
+# jpegtran 在 DCT 系数上做 90° 倍数的旋转和翻转，不需要解码再编码；没有安装时走 Pillow
+JPEGTRAN_PATH = os.getenv('JPEGTRAN_PATH') or shutil.which('jpegtran')
+JPEGTRAN_TIMEOUT = int(os.getenv('JPEGTRAN_TIMEOUT', 30))
+
+# EXIF 方向 -> 把像素转正需要的 jpegtran 参数
+ORIENTATION_JPEGTRAN = {
+    2: ['-flip', 'horizontal'],
+    3: ['-rotate', '180'],
+    4: ['-flip', 'vertical'],
+    5: ['-transpose'],
+    6: ['-rotate', '90'],
+    7: ['-transverse'],
+    8: ['-rotate', '270'],
+}
+
+
+def jpegtran(source, args: list):
+    """无损变换 JPEG，成功返回新的字节；图片尺寸不是 MCU 整数倍（-perfect 做不到无损）
+    或没有安装 jpegtran 时返回 None，由调用方退回解码再编码"""
+    if not JPEGTRAN_PATH:
+        return None
+    stream, cleanup = open_source(source)
+    try:
+        data = stream.read()
+    finally:
+        cleanup()
+    try:
+        completed = subprocess.run([JPEGTRAN_PATH, '-perfect', '-copy', 'all', *args],
+                                   input=data, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if completed.returncode != 0 or not completed.stdout:
+        return None
+    return completed.stdout
+
+
+def lossless_steps(transformations: dict):
+    """只包含 90° 倍数的旋转和翻转时，返回按顺序执行的 jpegtran 参数列表；否则返回 None"""
+    steps = []
+    for name, params in transformations.items():
+        if name == 'rotate' and params['angle'] % 90 == 0:
+            angle = int(params['angle']) % 360
+            if angle:
+                steps.append(['-rotate', str(angle)])
+        elif name == 'flip':
+            steps.append(['-flip', 'horizontal' if params.get('direction') == 'horizontal'
+                          else 'vertical'])
+        elif name in ('format', 'animation'):
+            # 输出格式已经由调用方确认是 JPEG
+            continue
+        else:
+            return None
+    return steps
+
+
+def reset_exif_orientation(data: bytes) -> bytes:
+    """把 JPEG 的 APP1 EXIF 中的方向标签改成 1（其他标签原样保留）；找不到时原样返回"""
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == 0xDA:
+            break
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            tiff = pos + 10
+            endian = '<' if data[tiff:tiff + 2] == b'II' else '>'
+            ifd = tiff + struct.unpack(endian + 'I', data[tiff + 4:tiff + 8])[0]
+            count = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+            for i in range(count):
+                entry = ifd + 2 + i * 12
+                if struct.unpack(endian + 'H', data[entry:entry + 2])[0] == EXIF_ORIENTATION:
+                    return data[:entry + 8] + struct.pack(endian + 'H', 1) + data[entry + 10:]
+            break
+        pos += 2 + length
+    return data
+
+
+def normalize_orientation(path: str, orientation: int):
+    """按 EXIF 方向把像素转正并清除方向标签，返回新文件的字节；动图和超出内存预算
+    又不能无损转换的图片返回 None，由调用方拒绝上传。
+    JPEG 优先用 jpegtran 无损转换，做不到时和其他格式一样解码、转正后用原格式重新编码：
+    JPEG 沿用原图的量化表和色度抽样（等同 quality='keep'，只有一次重新量化的误差，不会降到默认质量），
+    WebP 无损编码（像素不变，文件可能变大），PNG/GIF 本身就是无损的；
+    作为顶层函数以便在进程池中执行"""
+    with PILImage.open(path) as img:
+        image_format = img.format
+        if getattr(img, 'n_frames', 1) > 1:
+            return None
+        if image_format != 'JPEG' or orientation not in ORIENTATION_JPEGTRAN:
+            data = None
+        else:
+            data = jpegtran(path, ORIENTATION_JPEGTRAN[orientation])
+        if data is not None:
+            data = reset_exif_orientation(data)
+        elif bitmap_bytes(img.size, img.mode) * 2 > RENDER_MEMORY_BUDGET:
+            return None
+        else:
+            transposed = ImageOps.exif_transpose(img)
+            output_format = image_format.lower()
+            params = dict(ENCODER_PROFILES.get(output_format, {}))
+            if output_format == 'jpeg':
+                # 转正后的图片不再是 JpegImageFile，不能直接用 quality='keep'，显式传入原图的编码参数
+                params.pop('quality', None)
+                params['qtables'] = img.quantization
+                params['subsampling'] = JpegImagePlugin.get_sampling(img)
+            elif output_format == 'webp':
+                params.pop('quality', None)
+                params['lossless'] = True
+            # exif_transpose 已经去掉了方向标签，其余 EXIF 和色彩配置保留
+            if transposed.info.get('exif'):
+                params['exif'] = transposed.info['exif']
+            if img.info.get('icc_profile'):
+                params['icc_profile'] = img.info['icc_profile']
+            buffer = io.BytesIO()
+            transposed.save(buffer, format=OUTPUT_FORMATS.get(output_format, (image_format,))[0],
+                            **params)
+            data = buffer.getvalue()
+    return data
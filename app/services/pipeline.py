@@ -0,0 +1,409 @@
+import math
+import os
+import time
+from PIL import Image as PILImage
+
+from app.services.decode import RENDER_MEMORY_BUDGET, bitmap_bytes, check_budget, open_image
+from app.services.encoders import ANIMATED_FORMATS, encode, encode_animation
+from app.services.executor import open_source
+from app.services.filters import FilterChain
+from app.services.metadata import extract_metadata, make_placeholder
+from app.services.orientation import jpegtran, lossless_steps
+
+# 在内存中执行的几何操作，按请求中出现的顺序执行
+GEOMETRIC_OPS = ('crop', 'resize', 'rotate', 'flip')
+
+# resize 的速度/质量档位：
+#   draft_oversample - JPEG 用 DCT 缩放解码时，至少保留目标尺寸的几倍（None 表示不缩放解码）
+#   reducing_gap     - 先用 reduce() 做整数倍缩小，剩余倍数不超过该值时再做最终重采样
+RESIZE_MODES = {
+    'fast': {'draft_oversample': 1, 'reducing_gap': 2.0,
+             'resample': PILImage.Resampling.BILINEAR},
+    'balanced': {'draft_oversample': 2, 'reducing_gap': 3.0,
+                 'resample': PILImage.Resampling.LANCZOS},
+    'best': {'draft_oversample': None, 'reducing_gap': None,
+             'resample': PILImage.Resampling.LANCZOS},
+}
+DEFAULT_RESIZE_MODE = 'balanced'
+
+# resize 的尺寸语义：fill 拉伸到正好 width x height；contain 按比例缩放到框内，不放大
+RESIZE_FITS = ('fill', 'contain')
+DEFAULT_RESIZE_FIT = 'fill'
+
+# rotate 的角度按顺时针计算；90° 的倍数用 transpose 直接搬像素，其他角度按 resample 重采样并扩大画布
+ROTATE_RESAMPLES = {
+    'nearest': PILImage.Resampling.NEAREST,
+    'bilinear': PILImage.Resampling.BILINEAR,
+    'bicubic': PILImage.Resampling.BICUBIC,
+}
+DEFAULT_ROTATE_RESAMPLE = 'bicubic'
+_RIGHT_ANGLES = {
+    90: PILImage.Transpose.ROTATE_270,
+    180: PILImage.Transpose.ROTATE_180,
+    270: PILImage.Transpose.ROTATE_90,
+}
+
+# 动图默认把与上一帧完全相同的帧合并（时长相加），可以用 transformations 中的 animation.dedupe 覆盖
+ANIMATION_DEDUPE_FRAMES = os.getenv('ANIMATION_DEDUPE_FRAMES', 'true').lower() in ('1', 'true', 'yes')
+# 源帧没有声明时长时使用的默认值（毫秒）
+DEFAULT_FRAME_DURATION = 100
+
+
+class Operation:
+    def __init__(self, name: str, params: dict):
+        self.name = name
+        self.params = params
+
+    def __repr__(self):
+        return f"Operation({self.name!r}, {self.params!r})"
+
+
+class TransformPipeline:
+    """把 transformations 编译成有序的操作列表：一次解码，内存中依次执行，一次编码"""
+
+    def __init__(self, operations: list):
+        self.operations = operations
+
+    @classmethod
+    def compile(cls, transformations: dict):
+        operations = []
+        deferred = []
+        for name, params in transformations.items():
+            if name in GEOMETRIC_OPS:
+                operations.append(Operation(name, dict(params or {})))
+            elif name == 'filters':
+                chain = FilterChain.compile(params or {})
+                if not chain.stages:
+                    continue
+                # 纯颜色滤镜与几何操作可交换，放到最后在（通常更小的）结果图上执行
+                if chain.color_only:
+                    deferred.append(Operation('filters', chain))
+                else:
+                    operations.append(Operation('filters', chain))
+        return cls(cls._fold(operations) + deferred)
+
+    @staticmethod
+    def _fold(operations: list):
+        # crop 紧跟 resize 时合并为一次 resize(box=...)，省掉中间位图
+        folded = []
+        for op in operations:
+            prev = folded[-1] if folded else None
+            if op.name == 'resize' and prev is not None and prev.name == 'crop' \
+                    and 'box' not in op.params:
+                p = prev.params
+                box = (p['x'], p['y'], p['x'] + p['width'], p['y'] + p['height'])
+                folded[-1] = Operation('resize', dict(op.params, box=box))
+            else:
+                folded.append(op)
+        return folded
+
+    def prepare(self, img):
+        """在解码前调用：第一个操作是缩小时，让 JPEG 以 DCT 缩放直接解码到够用的最小分辨率；
+        按档位多保留的分辨率会超出内存预算时，退到只保证不小于目标尺寸"""
+        if not self.operations or self.operations[0].name != 'resize' \
+                or img.format != 'JPEG':
+            return
+        op = self.operations[0]
+        params = op.params
+        box = params.get('box') or (0, 0, img.width, img.height)
+        box_width, box_height = box[2] - box[0], box[3] - box[1]
+        if box_width <= 0 or box_height <= 0:
+            return
+
+        oversample = RESIZE_MODES[params.get('mode', DEFAULT_RESIZE_MODE)]['draft_oversample']
+        if oversample is None and self.peak_bytes(img.size, img.mode) <= RENDER_MEMORY_BUDGET:
+            return
+        for oversample in (oversample or 1, 1):
+            # 解码后 box 区域至少要有 目标尺寸 * oversample 那么大
+            requested = (math.ceil(img.width * params['width'] * oversample / box_width),
+                         math.ceil(img.height * params['height'] * oversample / box_height))
+            if self.peak_bytes(_draft_size(img.size, requested), img.mode) \
+                    <= RENDER_MEMORY_BUDGET:
+                break
+        if requested[0] >= img.width and requested[1] >= img.height:
+            return
+
+        original_size = img.size
+        img.draft(None, requested)
+        if img.size != original_size and 'box' in params:
+            scale_x = img.width / original_size[0]
+            scale_y = img.height / original_size[1]
+            op.params = dict(params, box=(box[0] * scale_x, box[1] * scale_y,
+                                          box[2] * scale_x, box[3] * scale_y))
+
+    def output_size(self, size: tuple) -> tuple:
+        for op in self.operations:
+            size = _output_size(op, size)
+        return size
+
+    def peak_bytes(self, size: tuple, mode: str) -> int:
+        """估算从 size 大小的解码结果开始的峰值位图内存：解码结果保留到编码结束，
+        每一步同时持有输入和输出"""
+        peak = previous = 0
+        output_size = size
+        for op in self.operations:
+            output_size = _output_size(op, output_size)
+            current = bitmap_bytes(output_size, mode)
+            peak = max(peak, previous + current)
+            previous = current
+        return bitmap_bytes(size, mode) + peak
+
+    def load(self, img):
+        """在内存预算内解码（在 prepare 之后调用），返回可以继续 apply 的图片；
+        无法在预算内完成时抛出 ImageOverBudget"""
+        check_budget(self.peak_bytes(img.size, img.mode))
+        img.load()
+        return img
+
+    def apply(self, img):
+        for op in self.operations:
+            img = _APPLY[op.name](img, op.params)
+        return img
+
+
+def _box_within(img, box):
+    return box[0] >= 0 and box[1] >= 0 and \
+        box[2] <= img.width and box[3] <= img.height
+
+
+def _draft_size(size: tuple, requested: tuple) -> tuple:
+    # 与 JpegImageFile.draft 选择缩放比例的规则一致：1/8、1/4、1/2 中不小于 requested 的最小尺寸
+    scale = min(size[0] // requested[0], size[1] // requested[1])
+    for s in (8, 4, 2, 1):
+        if scale >= s:
+            return ((size[0] + s - 1) // s, (size[1] + s - 1) // s)
+    return size
+
+
+def _box_size(box, size: tuple) -> tuple:
+    return (box[2] - box[0], box[3] - box[1]) if box is not None else size
+
+
+def _output_size(op, size: tuple) -> tuple:
+    if op.name == 'crop':
+        return (op.params['width'], op.params['height'])
+    if op.name == 'resize':
+        return fit_size(_box_size(op.params.get('box'), size), op.params)
+    if op.name == 'rotate':
+        return rotated_size(size, op.params['angle'])
+    return size
+
+
+def crop_in_bounds(transformations: dict, size: tuple) -> bool:
+    """按执行顺序推算每个几何操作之前的尺寸，检查 crop 区域是否落在当时的图片内"""
+    for name, params in transformations.items():
+        if name not in GEOMETRIC_OPS:
+            continue
+        op = Operation(name, params or {})
+        if name == 'crop' and (params['x'] + params['width'] > size[0] or
+                               params['y'] + params['height'] > size[1]):
+            return False
+        size = _output_size(op, size)
+    return True
+
+
+def rotated_size(size: tuple, angle: float) -> tuple:
+    angle = angle % 360
+    if angle in (90, 270):
+        return (size[1], size[0])
+    if angle in (0, 180):
+        return size
+    radians = math.radians(angle)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    return (math.ceil(size[0] * cos + size[1] * sin), math.ceil(size[0] * sin + size[1] * cos))
+
+
+def fit_size(source_size: tuple, params: dict) -> tuple:
+    if params.get('fit', DEFAULT_RESIZE_FIT) == 'contain':
+        scale = min(params['width'] / source_size[0], params['height'] / source_size[1], 1.0)
+        return (max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale)))
+    return (int(params['width']), int(params['height']))
+
+
+def _resize(img, params: dict):
+    box = params.get('box')
+    size = fit_size(_box_size(box, img.size), params)
+    # resize(box=...) 不允许越界，越界时退回 crop（会补黑边）再 resize
+    if box is not None and not _box_within(img, box):
+        img = img.crop(box)
+        box = None
+    mode = RESIZE_MODES[params.get('mode', DEFAULT_RESIZE_MODE)]
+    return img.resize(size, mode['resample'], box=box,
+                      reducing_gap=mode['reducing_gap'])
+
+
+def _crop(img, params: dict):
+    return img.crop((params['x'], params['y'],
+                     params['x'] + params['width'], params['y'] + params['height']))
+
+
+def _rotate(img, params: dict):
+    angle = params['angle'] % 360
+    if angle == 0:
+        return img
+    if angle in _RIGHT_ANGLES:
+        # 90° 的倍数只是搬动像素，没有重采样，比 rotate() 快得多且无损
+        return img.transpose(_RIGHT_ANGLES[angle])
+    # 任意角度：扩大画布容纳整张图，空出的角为透明（输出 JPEG 时铺白底）
+    if img.mode not in ('RGBA', 'LA'):
+        img = img.convert('RGBA')
+    return img.rotate(-angle, ROTATE_RESAMPLES[params.get('resample', DEFAULT_ROTATE_RESAMPLE)],
+                      expand=True)
+
+
+def _flip(img, params: dict):
+    # 根据方向翻转图片
+    if params.get('direction') == 'horizontal':
+        return img.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)
+    return img.transpose(PILImage.Transpose.FLIP_TOP_BOTTOM)
+
+
+_APPLY = {
+    'resize': _resize,
+    'crop': _crop,
+    'rotate': _rotate,
+    'flip': _flip,
+    'filters': lambda img, chain: chain.apply(img),
+}
+
+
+def _result_metadata(img, output_format: str, frame_count: int = 1) -> dict:
+    # 结果图还在内存中，顺便生成元数据，不必再解析一遍输出文件
+    return {
+        'width': img.width,
+        'height': img.height,
+        'image_format': output_format,
+        'color_mode': img.mode,
+        'frame_count': frame_count,
+        'orientation': 1,
+        'placeholder': make_placeholder(img),
+    }
+
+
+def _transform_frames(img, pipeline: TransformPipeline, mode: str, dedupe: bool):
+    """逐帧解码并变换，依次产出 (变换后的帧, 时长, disposal)。同一时间只有当前帧（以及 Pillow
+    合成用的上一帧）的原始位图在内存中；dedupe 时与上一帧完全相同的帧并入上一帧的时长"""
+    previous = None
+    for index in range(img.n_frames):
+        img.seek(index)
+        frame = pipeline.apply(img.convert(mode))
+        # WebP 在解码后才更新当前帧的时长
+        duration = img.info.get('duration') or DEFAULT_FRAME_DURATION
+        if dedupe and previous is not None and frame.size == previous[0].size and \
+                frame.tobytes() == previous[0].tobytes():
+            previous[1] += duration
+            continue
+        if previous is not None:
+            yield tuple(previous)
+        previous = [frame, duration, getattr(img, 'disposal_method', 0)]
+    if previous is not None:
+        yield tuple(previous)
+
+
+def _render_animation(img, pipeline: TransformPipeline, output_format: str, options: dict,
+                      timings: dict):
+    # 帧都是合成好的完整画面，统一转换成同一模式后再做变换
+    mode = 'RGBA' if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info else 'RGB'
+    loop = img.info.get('loop')
+    # 变换后的帧要保留到编码，源帧同时只有一帧
+    check_budget(pipeline.peak_bytes(img.size, mode) +
+                 img.n_frames * bitmap_bytes(pipeline.output_size(img.size), mode))
+
+    start = time.perf_counter()
+    frames, durations, disposal = [], [], []
+    for frame, duration, method in _transform_frames(
+            img, pipeline, mode, options.get('dedupe', ANIMATION_DEDUPE_FRAMES)):
+        frames.append(frame)
+        durations.append(duration)
+        # 有透明像素时每帧先恢复背景，否则上一帧会从当前帧的透明处露出来
+        disposal.append(2 if mode == 'RGBA' else method)
+    timings['frames'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = encode_animation(frames, output_format, durations, loop, disposal,
+                            options.get('quality'))
+    timings['encode'] = time.perf_counter() - start
+    return data, timings, _result_metadata(frames[0], output_format, len(frames))
+
+
+def _jpegtran_steps(source, steps: list):
+    data = source
+    for args in steps:
+        data = jpegtran(data, args)
+        if data is None:
+            return None
+    return data
+
+
+def render_image(source, transformations: dict, output_format: str):
+    """解码 -> 变换 -> 按输出格式编码，返回 (编码后的字节, 各阶段耗时, 结果的元数据)；
+    作为顶层函数以便在进程池中执行，耗时由调用方汇总到监控指标。
+    动图输出为 GIF/WebP 时逐帧变换并保留时长、循环次数和 disposal，其他格式只取第一帧"""
+    timings = {}
+    start = time.perf_counter()
+    stream, cleanup = open_source(source)
+    try:
+        with open_image(stream) as img:
+            timings['open'] = time.perf_counter() - start
+
+            pipeline = TransformPipeline.compile(transformations)
+            if img.format == 'JPEG' and output_format == 'jpeg':
+                # 只有 90° 倍数的旋转和翻转：在 DCT 系数上无损变换，不解码也不重新编码
+                steps = lossless_steps(transformations)
+                data = _jpegtran_steps(source, steps) if steps else None
+                if data is not None:
+                    timings['lossless'] = time.perf_counter() - start
+                    return data, timings, extract_metadata(data)
+            if getattr(img, 'n_frames', 1) > 1 and output_format in ANIMATED_FORMATS:
+                return _render_animation(
+                    img, pipeline, output_format,
+                    dict(transformations.get('animation') or {},
+                         quality=transformations.get('quality')), timings)
+
+            start = time.perf_counter()
+            pipeline.prepare(img)
+            img = pipeline.load(img)
+            timings['decode'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result_img = pipeline.apply(img)
+            timings['ops'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            data = encode(result_img, output_format, transformations.get('quality'))
+            timings['encode'] = time.perf_counter() - start
+            return data, timings, _result_metadata(result_img, output_format)
+    finally:
+        cleanup()
+
+
+def render_presets(source, presets: list, output_format: str) -> list:
+    """一次解码生成多个预设尺寸：从最大的开始，每一级都从上一级的结果继续缩小，
+    而不是每个尺寸都从原图缩放。presets 为 [(name, resize 参数)]，返回 [(name, 字节, 元数据)]"""
+    ordered = sorted(presets, key=lambda p: p[1]['width'] * p[1]['height'], reverse=True)
+    stream, cleanup = open_source(source)
+    try:
+        with open_image(stream) as img:
+            if getattr(img, 'n_frames', 1) > 1 and output_format in ANIMATED_FORMATS:
+                # 动图的每个尺寸分别逐帧生成，不同时保留多个尺寸的全部帧
+                results = []
+                for name, params in ordered:
+                    data, _, metadata = _render_animation(
+                        img, TransformPipeline([Operation('resize', dict(params))]),
+                        output_format, {}, {})
+                    results.append((name, data, metadata))
+                return results
+
+            # 按最大的预设做 JPEG 缩放解码；超出内存预算的分条源图直接分条缩小到最大的预设
+            largest = TransformPipeline([Operation('resize', dict(ordered[0][1]))])
+            largest.prepare(img)
+            current = largest.apply(largest.load(img))
+            results = []
+            for i, (name, params) in enumerate(ordered):
+                if i:
+                    current = _resize(current, params)
+                results.append((name, encode(current, output_format),
+                                _result_metadata(current, output_format)))
+            return results
+    finally:
+        cleanup()
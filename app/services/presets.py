@@ -0,0 +1,30 @@
+import os
+
+# 上传后预先生成的尺寸：名称=宽x高，按比例缩放到框内，不放大
+DEFAULT_IMAGE_PRESETS = 'thumb=150x150,small=320x320,medium=800x800,large=1600x1600'
+# 上传完成后是否立即在后台生成全部预设尺寸
+IMAGE_PRESETS_EAGER = os.getenv('IMAGE_PRESETS_EAGER', 'true').lower() in ('1', 'true', 'yes')
+
+
+def parse_presets(value: str) -> dict:
+    presets = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, size = item.partition('=')
+        width, _, height = size.lower().partition('x')
+        try:
+            width, height = int(width), int(height)
+        except ValueError:
+            raise ValueError(f"Invalid image preset: {item!r}, expected name=WIDTHxHEIGHT")
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid image preset: {item!r}")
+        presets[name.strip()] = {'width': width, 'height': height}
+    return presets
+
+
+IMAGE_PRESETS = parse_presets(os.getenv('IMAGE_PRESETS', DEFAULT_IMAGE_PRESETS))
+
+
+def preset_transformations(name: str) -> dict:
+    """预设对应的 transformations，与客户端直接请求同样参数时得到同一个衍生图 key"""
+    size = IMAGE_PRESETS[name]
+    return {'resize': {'width': size['width'], 'height': size['height'], 'fit': 'contain'}}
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import hmac
+import math
+import os
+import time
+from urllib.parse import urlencode
+
+from app.services.encoders import ENCODER_PROFILES, supported_formats
+from app.services.pipeline import RESIZE_FITS
+
+# 签名渲染 URL 的密钥。没有单独配置时从 JWT 密钥派生一个子密钥（对固定标签做 HMAC），
+# 不直接复用签发登录 token 的密钥
+RENDER_SIGNING_LABEL = b'image-service/render-url-signing/v1'
+
+
+def _signing_key() -> bytes:
+    key = os.getenv('RENDER_SIGNING_KEY')
+    if key:
+        return key.encode()
+    jwt_secret = os.getenv('JWT_SECRET_KEY')
+    if jwt_secret:
+        return hmac.new(jwt_secret.encode(), RENDER_SIGNING_LABEL, hashlib.sha256).digest()
+    return b''
+
+
+RENDER_SIGNING_KEY = _signing_key()
+# 允许的输出尺寸：请求的尺寸向上取到最近的一档，不同客户端的相近尺寸共用同一个衍生图
+RENDER_SIZES = sorted({int(size) for size in os.getenv(
+    'RENDER_SIZES',
+    '16,32,48,64,96,128,160,200,256,320,400,480,640,800,960,1080,1280,1600,1920,2560,3840'
+).split(',') if size.strip()})
+# 质量参数按该步长取整
+RENDER_QUALITY_STEP = int(os.getenv('RENDER_QUALITY_STEP', 5))
+# 签名 URL 的有效期（秒），0 表示不过期；过期时间按有效期对齐，同一时间段内签出的 URL 相同
+RENDER_URL_TTL = int(os.getenv('RENDER_URL_TTL', 0))
+
+DEFAULT_RENDER_FIT = 'contain'
+# 参与签名的参数，canonical 形式按名称排序
+RENDER_PARAMS = ('exp', 'fit', 'fmt', 'h', 'q', 'v', 'w')
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def snap_size(value: int) -> int:
+    return next((size for size in RENDER_SIZES if size >= value), RENDER_SIZES[-1])
+
+
+def _positive_int(args, name: str):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {args.get(name)!r}")
+    if value <= 0:
+        raise ValueError(f"Invalid {name}: {value}")
+    return value
+
+
+def canonicalize(args, source_format: str = None) -> dict:
+    """把查询参数规范化：补全默认值后去掉等于默认值的参数、尺寸吸附到允许的档位、质量取整。
+    source_format 为原图格式，没有 fmt 时输出即为该格式。
+    返回的参数决定渲染结果，也是签名的内容；参数非法时抛出 ValueError"""
+    params = {}
+    width, height = _positive_int(args, 'w'), _positive_int(args, 'h')
+    fit = args.get('fit') or DEFAULT_RENDER_FIT
+    if fit not in RESIZE_FITS:
+        raise ValueError(f"Invalid fit: {fit!r}")
+    if width or height:
+        if fit == 'fill' and not (width and height):
+            raise ValueError("fit=fill needs both w and h")
+        if fit == 'fill':
+            # 拉伸时两边按同一比例吸附，保持请求的宽高比
+            longest = max(width, height)
+            scale = snap_size(longest) / longest
+            width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        else:
+            width = snap_size(width) if width else None
+            height = snap_size(height) if height else None
+        if fit != DEFAULT_RENDER_FIT:
+            params['fit'] = fit
+        if width:
+            params['w'] = str(width)
+        if height:
+            params['h'] = str(height)
+
+    fmt = (args.get('fmt') or '').lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt:
+        if fmt != 'auto' and fmt not in supported_formats():
+            raise ValueError(f"Unsupported fmt: {fmt!r}")
+        params['fmt'] = fmt
+
+    # 质量只对 JPEG/WebP/AVIF 输出有意义，其他输出格式去掉 q，不同的 q 不会产生不同的 URL 和衍生图；
+    # auto 在请求时才协商出格式，保留 q
+    output_format = fmt or source_format
+    quality = _positive_int(args, 'q')
+    if quality is not None and (output_format in (None, 'auto') or
+                                'quality' in ENCODER_PROFILES.get(output_format, {})):
+        quality = min(100, max(RENDER_QUALITY_STEP,
+                               round(quality / RENDER_QUALITY_STEP) * RENDER_QUALITY_STEP))
+        params['q'] = str(quality)
+
+    for name in ('v', 'exp'):
+        if args.get(name):
+            params[name] = args[name]
+    return params
+
+
+def canonical_query(params: dict) -> str:
+    return urlencode([(name, params[name]) for name in RENDER_PARAMS if name in params])
+
+
+def to_transformations(params: dict) -> dict:
+    transformations = {}
+    if 'w' in params or 'h' in params:
+        # 只给一边时另一边不限制（按允许的最大档位），fit 只能是 contain
+        transformations['resize'] = {
+            'width': int(params.get('w', RENDER_SIZES[-1])),
+            'height': int(params.get('h', RENDER_SIZES[-1])),
+            'fit': params.get('fit', DEFAULT_RENDER_FIT),
+        }
+    if params.get('fmt') not in (None, 'auto'):
+        transformations['format'] = params['fmt']
+    if 'q' in params:
+        transformations['quality'] = int(params['q'])
+    return transformations
+
+
+def content_version(content_hash: str) -> str:
+    # 原图被替换后版本变化，旧的签名 URL 不再有效，CDN 可以把结果当作永不变化
+    return content_hash[:16]
+
+
+def _signature(image_id: int, query: str) -> str:
+    if not RENDER_SIGNING_KEY:
+        raise InvalidSignature("Render URL signing is not configured")
+    digest = hmac.new(RENDER_SIGNING_KEY, f"{image_id}?{query}".encode(),
+                      hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:20]).decode().rstrip('=')
+
+
+def sign(image_id: int, params: dict, version: str, now: float = None) -> str:
+    """返回带签名的 canonical 查询串"""
+    params = dict(params, v=version)
+    if RENDER_URL_TTL:
+        now = time.time() if now is None else now
+        params['exp'] = str(int(math.ceil(now / RENDER_URL_TTL) + 1) * RENDER_URL_TTL)
+    query = canonical_query(params)
+    return f"{query}&sig={_signature(image_id, query)}"
+
+
+def verify(image_id: int, params: dict, signature: str, now: float = None):
+    """校验签名和有效期，失败时抛出 InvalidSignature"""
+    if not hmac.compare_digest(_signature(image_id, canonical_query(params)), signature or ''):
+        raise InvalidSignature("Invalid signature")
+    if 'exp' in params:
+        try:
+            expires = int(params['exp'])
+        except ValueError:
+            raise InvalidSignature("Invalid expiry")
+        if expires < (time.time() if now is None else now):
+            raise InvalidSignature("Signature expired")
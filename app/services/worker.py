@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from werkzeug.exceptions import HTTPException
+
+from app.models import get_db, remove_db
+from app.services.executor import configure_executor
+from app.services.jobs import get_job_queue
+from app.services.metrics import start_metrics_server
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', os.cpu_count() or 1))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+# 大于 0 时第 i 个 worker 在 WORKER_METRICS_PORT + i 端口提供 /metrics
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 0))
+
+logger = logging.getLogger(__name__)
+
+
+def handle_transform(payload: dict):
+    from app.services.image_processor import ImageTransformService
+
+    db = get_db()
+    try:
+        return ImageTransformService(db).process_image(
+            payload['image_id'], payload['transformations'],
+            payload.get('output_format'))
+    finally:
+        remove_db()
+
+
+def handle_presets(payload: dict):
+    from app.services.image_processor import ImageTransformService
+
+    db = get_db()
+    try:
+        service = ImageTransformService(db)
+        if 'image_ids' in payload:
+            # 批量上传的一批图片共用一个任务；已经生成的尺寸会跳过，重试是安全的
+            results = {}
+            for image_id in payload['image_ids']:
+                try:
+                    results[image_id] = service.generate_presets(image_id, payload.get('names'))
+                except ValueError:
+                    # 图片在任务执行前已被删除
+                    continue
+            return results
+        return service.generate_presets(payload['image_id'], payload.get('names'))
+    finally:
+        remove_db()
+
+
+# 任务类型 -> 处理函数
+JOB_HANDLERS = {
+    'transform': handle_transform,
+    'presets': handle_presets,
+}
+
+
+def work_loop(poll_interval: float = JOB_POLL_INTERVAL, slot: int = 0):
+    """单个 worker 进程：不断领取任务并执行，收到 SIGTERM 后处理完当前任务再退出"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # worker 进程本身已经按核数启动，图片处理直接在本进程执行，不再套一层进程池
+    configure_executor(0)
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT + slot)
+    queue = get_job_queue()
+    while not stopping:
+        job = queue.reserve()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        handler = JOB_HANDLERS.get(job['type'])
+        if handler is None:
+            queue.fail(job['id'], f"Unknown job type: {job['type']}")
+            continue
+
+        try:
+            result = handler(job['payload'])
+            queue.complete(job['id'], result)
+        except HTTPException as e:
+            # 4xx（例如图片超出像素上限 413、超出内存预算 422）重试也不会成功，直接失败
+            logger.warning("Job %s failed: %s", job['id'], e)
+            queue.fail(job['id'], str(e), retry=e.code >= 500)
+        except Exception as e:
+            logger.exception("Job %s failed", job['id'])
+            queue.fail(job['id'], str(e))
+
+
+def run_workers(count: int = JOB_WORKERS):
+    """启动 count 个 worker 进程，任何一个退出都会被重新拉起"""
+    processes = {}
+    stopping = False
+
+    def spawn(slot: int):
+        # 固定槽位，重新拉起的进程沿用同一个监控端口
+        process = multiprocessing.Process(target=work_loop,
+                                          kwargs={'slot': slot})
+        process.start()
+        processes[process.pid] = (process, slot)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(count):
+        spawn(slot)
+
+    while not stopping:
+        for pid, (process, slot) in list(processes.items()):
+            if not process.is_alive():
+                del processes[pid]
+                spawn(slot)
+        time.sleep(1)
+
+    for process, _ in processes.values():
+        process.terminate()
+    for process, _ in processes.values():
+        process.join()
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import time
+
+from sqlalchemy import event
+
+from app.models import get_db
+from app.models.user import User
+from app.services.cache import RedisCache, TTLCache
+from app.services.metrics import cache_hit, cache_miss
+from .jwt_utils import decode_jwt_token
+
+# 用户快照在本进程内缓存的秒数；跨进程的失效最多延迟这么久
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', 10000))
+# 是否把用户快照同时放到 Redis，供多个进程共享
+AUTH_CACHE_USE_REDIS = os.getenv('AUTH_CACHE_USE_REDIS', 'false').lower() in ('1', 'true', 'yes')
+
+
+class UserSnapshot:
+    """login_required 传给处理函数的轻量用户信息，不是绑定会话的 ORM 对象"""
+
+    __slots__ = ('id', 'username')
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+    @classmethod
+    def from_user(cls, user: User):
+        return cls(user.id, user.username)
+
+    def to_dict(self):
+        return {'id': self.id, 'username': self.username}
+
+
+_claims_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES)
+_user_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES)
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None and AUTH_CACHE_USE_REDIS:
+        _redis = RedisCache()
+    return _redis
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def verify_token(token: str) -> dict:
+    """校验 JWT 并返回 claims；校验结果缓存到 token 的 exp 为止"""
+    key = _token_key(token)
+    claims = _claims_cache.get(key)
+    if claims is not None:
+        cache_hit('auth_claims')
+        return claims
+    cache_miss('auth_claims')
+
+    claims = decode_jwt_token(token)
+    expires_at = float(claims.get('exp', time.time() + AUTH_USER_CACHE_TTL))
+    _claims_cache.set(key, claims, expires_at)
+    return claims
+
+
+def resolve_user(user_id: int):
+    """返回 UserSnapshot，依次查本进程缓存、Redis（可选）、数据库；用户不存在返回 None"""
+    snapshot = _user_cache.get(user_id)
+    if snapshot is not None:
+        cache_hit('auth_user')
+        return snapshot
+    cache_miss('auth_user')
+
+    redis_cache = _get_redis()
+    if redis_cache is not None:
+        cached = redis_cache.get(f"auth:user:{user_id}")
+        if cached:
+            snapshot = UserSnapshot(cached['id'], cached['username'])
+            _user_cache.set(user_id, snapshot, time.time() + AUTH_USER_CACHE_TTL)
+            return snapshot
+
+    db = get_db()
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        return None
+
+    snapshot = UserSnapshot.from_user(user)
+    _user_cache.set(user_id, snapshot, time.time() + AUTH_USER_CACHE_TTL)
+    if redis_cache is not None:
+        redis_cache.set(f"auth:user:{user_id}", snapshot.to_dict(),
+                        expire=AUTH_USER_CACHE_TTL)
+    return snapshot
+
+
+def invalidate_token(token: str):
+    _claims_cache.delete(_token_key(token))
+
+
+def invalidate_user(user_id: int):
+    """用户被删除或修改密码后调用：清掉用户快照及该用户已缓存的 token"""
+    _user_cache.delete(user_id)
+    _claims_cache.delete_where(lambda claims: claims.get('user_id') == user_id)
+    redis_cache = _get_redis()
+    if redis_cache is not None:
+        redis_cache.delete(f"auth:user:{user_id}")
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_on_change(mapper, connection, target):
+    invalidate_user(target.id)
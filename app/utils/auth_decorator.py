@@ -1,8 +1,7 @@
 from functools import wraps
 from flask import request
-from .jwt_utils import decode_jwt_token
-from app.models import get_db
-from app.models.user import User
+from app.services.metrics import AUTH_STAGE_SECONDS
+from .auth_cache import resolve_user, verify_token
 
 
 def login_required(f):
@@ -17,15 +16,13 @@ def login_required(f):
             return {'message': 'Token is missing'}, 401
 
         try:
-            # 解码token
-            payload = decode_jwt_token(token)
-            print(payload)
-
-            # 获取用户
-            db = next(get_db())
-            current_user = db.query(User).filter(
-                User.id == payload['user_id']
-            ).first()
+            # 解码token（校验结果按 token 缓存到过期为止）
+            with AUTH_STAGE_SECONDS.time(stage='verify_token'):
+                payload = verify_token(token)
+
+            # 获取用户（优先使用缓存的用户快照，避免每个请求都查库）
+            with AUTH_STAGE_SECONDS.time(stage='resolve_user'):
+                current_user = resolve_user(payload['user_id'])
 
             if not current_user:
                 return {'message': 'Invalid token'}, 401
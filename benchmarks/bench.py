@@ -0,0 +1,314 @@
+"""图片处理热点路径的基准测试。
+
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.compare baseline.json results.json --threshold 0.15
+
+用临时目录中的 SQLite 代替 MySQL、fakeredis 代替 Redis，不依赖外部服务。
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import fixtures
+
+DEFAULT_ITERATIONS = {'small': 20, 'medium': 10, 'large': 3}
+LIST_SIZES = (10, 1000, 100000)
+
+CHAINS = {
+    'crop_resize_flip': lambda w, h: {
+        'crop': {'x': w // 8, 'y': h // 8, 'width': w * 3 // 4, 'height': h * 3 // 4},
+        'resize': {'width': 320, 'height': 240},
+        'flip': {'direction': 'horizontal'},
+    },
+    'resize_webp': lambda w, h: {
+        'resize': {'width': 800, 'height': 600},
+        'format': 'webp',
+    },
+    'resize_filters': lambda w, h: {
+        'resize': {'width': 800, 'height': 600},
+        'filters': {'brightness': 1.1, 'contrast': 1.2, 'sepia': True},
+    },
+}
+
+OPERATIONS = {
+    'resize': ('resize_image', lambda w, h: {'width': 320, 'height': 240}),
+    'crop': ('crop_image', lambda w, h: {'x': w // 4, 'y': h // 4,
+                                         'width': w // 2, 'height': h // 2}),
+    'rotate': ('rotate_image', lambda w, h: {'angle': 90}),
+    'flip': ('flip_image', lambda w, h: {'direction': 'vertical'}),
+}
+
+
+def summarize(samples: list) -> dict:
+    samples_ms = sorted(s * 1000 for s in samples)
+    mean = statistics.fmean(samples_ms)
+    return {
+        'iterations': len(samples_ms),
+        'mean_ms': mean,
+        'median_ms': statistics.median(samples_ms),
+        'p95_ms': samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))],
+        'min_ms': samples_ms[0],
+        'max_ms': samples_ms[-1],
+        'stdev_ms': statistics.stdev(samples_ms) if len(samples_ms) > 1 else 0.0,
+        'ops_per_sec': 1000 / mean if mean else 0.0,
+    }
+
+
+def measure(fn, iterations: int, setup=None, warmup: int = 1) -> dict:
+    """setup 的耗时不计入；fn 接收 setup 的返回值"""
+    for _ in range(warmup):
+        fn(setup() if setup else None)
+    samples = []
+    for _ in range(iterations):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+
+    def record(self, name: str, result: dict):
+        self.results[name] = result
+        print(f"{name:<48} {result['mean_ms']:>10.2f} ms  "
+              f"p95 {result['p95_ms']:>10.2f} ms  {result['ops_per_sec']:>8.1f} ops/s",
+              flush=True)
+
+    def setup(self):
+        from app.models import create_tables, get_db
+        from app.models.user import User
+        from app.utils.jwt_utils import generate_jwt_token
+        from run import app
+
+        create_tables()
+        self.app = app
+        self.client = app.test_client()
+        self.db = get_db()
+        user = User(username='bench', password='x',
+                    created_at=datetime.now(), updated_at=datetime.now())
+        self.db.add(user)
+        self.db.commit()
+        self.user_id = user.id
+        self.headers = {'token': generate_jwt_token(user.id)}
+
+        self.sources = {}
+        for size_name in self.args.sizes:
+            img = fixtures.synthetic_image(fixtures.IMAGE_SIZES[size_name])
+            for image_format in self.args.formats:
+                if image_format == 'gif' and size_name == 'large':
+                    continue
+                self.sources[(image_format, size_name)] = (
+                    fixtures.encode_image(img, image_format), img.size)
+
+    def iterations(self, size_name: str) -> int:
+        return self.args.iterations or DEFAULT_ITERATIONS[size_name]
+
+    def new_image(self, image_format: str, size_name: str, cold: bool = True):
+        """每次测量都用一条新记录和一份新文件；cold 时先清空缓存"""
+        from app.models.image import Image
+        from app.services.image_processor import ImageListService
+
+        if cold:
+            fixtures.reset_caches()
+        data, _ = self.sources[(image_format, size_name)]
+        ext = fixtures.IMAGE_FORMATS[image_format][1]
+        storage_name = Image.generate_storage_name(f"bench{ext}")
+        path = fixtures.write_image(os.path.join('uploads', 'bench'), storage_name, data)
+        image = Image(filename=f"bench{ext}", storage_name=storage_name, file_path=path,
+                      file_size=len(data), mime_type=fixtures.IMAGE_FORMATS[image_format][2],
+                      user_id=self.user_id)
+        ImageListService(self.db).create_image(image)
+        return image.id
+
+    def run_transforms(self):
+        from app.services.image_processor import ImageTransformService
+
+        for (image_format, size_name), (_, (width, height)) in self.sources.items():
+            for op_name, (method, params) in OPERATIONS.items():
+                def run(image_id, method=method, params=params(width, height)):
+                    getattr(ImageTransformService(self.db), method)(image_id, params)
+                self.record(f"transform.{op_name}.{image_format}.{size_name}",
+                            measure(run, self.iterations(size_name),
+                                    setup=lambda: self.new_image(image_format, size_name)))
+
+            for chain_name, spec in CHAINS.items():
+                def run(image_id, spec=spec(width, height)):
+                    ImageTransformService(self.db).process_image(image_id, dict(spec))
+                self.record(f"chain.{chain_name}.{image_format}.{size_name}",
+                            measure(run, self.iterations(size_name),
+                                    setup=lambda: self.new_image(image_format, size_name)))
+
+    def run_cached_transform(self):
+        from app.services.image_processor import ImageTransformService
+
+        key = ('jpeg', 'medium')
+        if key not in self.sources:
+            return
+        spec = {'resize': {'width': 320, 'height': 240}}
+        # 同一份源内容、同样参数的重复渲染：第一次之后都应命中衍生图缓存
+        image_ids = []
+
+        def setup():
+            if not image_ids:
+                image_ids.append(self.new_image(*key))
+                ImageTransformService(self.db).process_image(image_ids[0], dict(spec))
+            return self.new_image(*key, cold=False)
+
+        def run(image_id):
+            ImageTransformService(self.db).process_image(image_id, dict(spec))
+        self.record("transform.cached.resize.jpeg.medium",
+                    measure(run, self.iterations('medium'), setup=setup, warmup=0))
+
+    def run_uploads(self):
+        import io
+
+        for (image_format, size_name), (data, _) in self.sources.items():
+            _, ext, mime_type, _ = fixtures.IMAGE_FORMATS[image_format]
+            # 每次上传不同的内容（生成耗时不计入）：相同的内容会命中 blob 去重，
+            # 测到的只是引用计数加一，而不是写入、解析元数据的完整路径
+            seen = set()
+
+            def setup(data=data, image_format=image_format, seen=seen):
+                variant = fixtures.unique_variant(data, image_format, len(seen))
+                digest = hashlib.sha256(variant).digest()
+                assert digest not in seen, 'upload payloads must differ between iterations'
+                seen.add(digest)
+                return variant
+
+            def run(variant, ext=ext, mime_type=mime_type):
+                response = self.client.post(
+                    '/images', headers=self.headers, content_type='multipart/form-data',
+                    data={'file': (io.BytesIO(variant), f"upload{ext}", mime_type)})
+                assert response.status_code == 201, response.get_data(as_text=True)
+            self.record(f"upload.{image_format}.{size_name}",
+                        measure(run, self.iterations(size_name), setup=setup))
+
+    def run_listing(self):
+        from sqlalchemy import insert
+
+        from app.models.image import Image
+        from app.models.user import User
+        from app.services.image_processor import encode_cursor
+        from app.utils.jwt_utils import generate_jwt_token
+
+        sizes = [n for n in LIST_SIZES if n <= self.args.max_list_rows]
+        for rows in sizes:
+            user = User(username=f"list{rows}", password='x',
+                        created_at=datetime.now(), updated_at=datetime.now())
+            self.db.add(user)
+            self.db.commit()
+            start = datetime(2020, 1, 1)
+            batch = []
+            for i in range(rows):
+                batch.append({
+                    'filename': f"img{i}.jpg", 'storage_name': f"{i}.jpg",
+                    'file_path': f"uploads/{i}.jpg", 'file_size': 1024,
+                    'mime_type': 'image/jpeg' if i % 2 else 'image/png',
+                    'user_id': user.id,
+                    'created_at': start + timedelta(seconds=i),
+                    'updated_at': start + timedelta(seconds=i),
+                })
+                if len(batch) == 10000:
+                    self.db.execute(insert(Image), batch)
+                    batch = []
+            if batch:
+                self.db.execute(insert(Image), batch)
+            self.db.commit()
+
+            headers = {'token': generate_jwt_token(user.id)}
+            middle = rows // 2
+            cursor = encode_cursor(start + timedelta(seconds=middle), 10 ** 12)
+
+            def first_page(_, headers=headers):
+                response = self.client.get('/images?limit=50', headers=headers)
+                assert response.status_code == 200
+            self.record(f"list.{rows}.first_page", measure(first_page, 20))
+
+            def deep_page(_, headers=headers, cursor=cursor):
+                response = self.client.get(f"/images?limit=50&cursor={cursor}",
+                                           headers=headers)
+                assert response.status_code == 200
+            self.record(f"list.{rows}.deep_page", measure(deep_page, 20))
+
+    def run(self):
+        self.setup()
+        groups = self.args.groups
+        if 'transform' in groups:
+            self.run_transforms()
+            self.run_cached_transform()
+        if 'upload' in groups:
+            self.run_uploads()
+        if 'list' in groups:
+            self.run_listing()
+        return self.results
+
+
+def environment_info() -> dict:
+    import PIL
+    import sqlalchemy
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the image processing hot paths')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='where to write the JSON results')
+    parser.add_argument('--groups', nargs='+', default=['transform', 'upload', 'list'],
+                        choices=['transform', 'upload', 'list'])
+    parser.add_argument('--sizes', nargs='+', default=list(fixtures.IMAGE_SIZES),
+                        choices=list(fixtures.IMAGE_SIZES))
+    parser.add_argument('--formats', nargs='+', default=list(fixtures.IMAGE_FORMATS),
+                        choices=list(fixtures.IMAGE_FORMATS))
+    parser.add_argument('--iterations', type=int, default=None,
+                        help='override the per-size iteration counts')
+    parser.add_argument('--max-list-rows', type=int, default=max(LIST_SIZES))
+    parser.add_argument('--executor', choices=['inline', 'pool'], default='inline',
+                        help='inline measures per-op latency without IPC overhead')
+    parser.add_argument('--redis', choices=['fake', 'real'], default='fake')
+    parser.add_argument('--quick', action='store_true',
+                        help='small images, few iterations, at most 1k listing rows')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes = ['small']
+        args.iterations = args.iterations or 3
+        args.max_list_rows = min(args.max_list_rows, 1000)
+
+    output = os.path.abspath(args.output)
+    workdir = fixtures.make_environment()
+    # 环境变量必须在导入 app 之前设置好
+    if args.redis == 'fake':
+        fixtures.use_fake_redis()
+    from app.services.executor import configure_executor
+    if args.executor == 'inline':
+        configure_executor(0)
+
+    # 上传目录、衍生图缓存都使用相对路径，切到临时目录下避免污染仓库
+    os.chdir(workdir)
+    results = Bench(args).run()
+
+    with open(output, 'w') as f:
+        json.dump({'environment': environment_info(), 'results': results}, f, indent=2)
+    print(f"\nWrote {len(results)} results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""对比两次基准测试结果，任一项的平均耗时超过阈值时以非零状态退出，供 CI 使用。
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.10 \\
+        --override 'upload.*=0.25' --override list.100000.deep_page=0.3
+"""
+import argparse
+import fnmatch
+import json
+import sys
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def parse_overrides(values: list) -> list:
+    overrides = []
+    for value in values or []:
+        pattern, _, threshold = value.partition('=')
+        if not threshold:
+            raise ValueError(f"Invalid override {value!r}, expected PATTERN=THRESHOLD")
+        overrides.append((pattern, float(threshold)))
+    return overrides
+
+
+def threshold_for(name: str, default: float, overrides: list) -> float:
+    # 后出现的规则优先
+    for pattern, threshold in reversed(overrides):
+        if fnmatch.fnmatchcase(name, pattern):
+            return threshold
+    return default
+
+
+def compare(baseline: dict, current: dict, default: float, overrides: list,
+            metric: str = 'mean_ms') -> list:
+    """返回 (name, 基线, 当前, 变化比例, 阈值, 状态) 列表"""
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in current:
+            rows.append((name, baseline[name][metric], None, None, None, 'missing'))
+            continue
+        if name not in baseline:
+            rows.append((name, None, current[name][metric], None, None, 'new'))
+            continue
+        before, after = baseline[name][metric], current[name][metric]
+        change = (after - before) / before if before else 0.0
+        threshold = threshold_for(name, default, overrides)
+        status = 'REGRESSED' if change > threshold else 'ok'
+        rows.append((name, before, after, change, threshold, status))
+    return rows
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare benchmark results against a baseline')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed slowdown as a fraction, e.g. 0.10 = 10%%')
+    parser.add_argument('--override', action='append', metavar='PATTERN=THRESHOLD',
+                        help='per-benchmark threshold, glob patterns allowed')
+    parser.add_argument('--metric', default='mean_ms', choices=['mean_ms', 'median_ms', 'p95_ms'])
+    parser.add_argument('--fail-on-missing', action='store_true',
+                        help='also fail when a baseline benchmark is absent from the current run')
+    args = parser.parse_args(argv)
+
+    rows = compare(load_results(args.baseline), load_results(args.current),
+                   args.threshold, parse_overrides(args.override), args.metric)
+
+    print(f"{'benchmark':<48} {'baseline':>10} {'current':>10} {'change':>8} {'limit':>6}  status")
+    for name, before, after, change, threshold, status in rows:
+        print(f"{name:<48} {_fmt(before, '10.2f'):>10} {_fmt(after, '10.2f'):>10} "
+              f"{_fmt(change, '+8.1%'):>8} {_fmt(threshold, '6.0%'):>6}  {status}")
+
+    failed = [row for row in rows if row[5] == 'REGRESSED'
+              or (args.fail_on_missing and row[5] == 'missing')]
+    if failed:
+        print(f"\n{len(failed)} benchmark(s) regressed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image as PILImage
+
+# 合成图片的尺寸档位
+IMAGE_SIZES = {
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (6000, 4000),
+}
+
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg', {'quality': 90}),
+    'png': ('PNG', '.png', 'image/png', {}),
+    'gif': ('GIF', '.gif', 'image/gif', {}),
+    'webp': ('WEBP', '.webp', 'image/webp', {'quality': 80}),
+}
+
+
+def make_environment(workdir: str = None) -> str:
+    """在导入 app 之前调用：用临时目录里的 SQLite 代替 MySQL，并补齐 JWT 配置"""
+    workdir = workdir or tempfile.mkdtemp(prefix='ips-bench-')
+    os.environ.setdefault('DATABASE_URL',
+                          f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret')
+    os.environ.setdefault('JWT_ALGORITHM', 'HS256')
+    os.environ.setdefault('JOB_QUEUE_BACKEND', 'sqlite')
+    os.environ.setdefault('JOB_QUEUE_SQLITE_PATH', os.path.join(workdir, 'jobs.sqlite3'))
+    return workdir
+
+
+def use_fake_redis():
+    """把共享的 Redis 连接池换成 fakeredis，所有 RedisCache / 任务队列都会用它"""
+    import fakeredis
+    import redis
+
+    from app.services import cache
+
+    cache._pool = redis.ConnectionPool(connection_class=fakeredis.FakeConnection,
+                                       server=fakeredis.FakeServer())
+
+
+def reset_caches():
+    """清空 Redis、本地缓存和磁盘衍生图，保证下一次测量是冷缓存"""
+    from app.services import cache, derivative_cache
+
+    cache.get_redis_client().flushall()
+    cache._local.clear()
+    if os.path.isdir(derivative_cache.DERIVATIVE_CACHE_DIR):
+        shutil.rmtree(derivative_cache.DERIVATIVE_CACHE_DIR)
+    derivative_cache._approx_bytes = None
+
+
+def synthetic_image(size: tuple) -> PILImage.Image:
+    """噪声 + 渐变，压缩率接近真实照片，避免纯色图让编码器占便宜"""
+    noise = PILImage.effect_noise(size, 48)
+    linear = PILImage.linear_gradient('L').resize(size)
+    radial = PILImage.radial_gradient('L').resize(size)
+    return PILImage.merge('RGB', (noise, linear, radial))
+
+
+def encode_image(img: PILImage.Image, image_format: str) -> bytes:
+    pil_format, _, _, params = IMAGE_FORMATS[image_format]
+    buffer = io.BytesIO()
+    img.save(buffer, format=pil_format, **params)
+    return buffer.getvalue()
+
+
+def unique_variant(data: bytes, image_format: str, index: int) -> bytes:
+    """改动第 index 个像素后重新编码：每次上传的内容都不同，不会被按内容哈希去重"""
+    with PILImage.open(io.BytesIO(data)) as img:
+        img = img.copy()
+    xy = (index % img.width, index // img.width % img.height)
+    value = img.getpixel(xy)
+    if isinstance(value, tuple):
+        img.putpixel(xy, tuple(255 - v for v in value))
+    else:
+        img.putpixel(xy, (value + 1) % 256)
+    return encode_image(img, image_format)
+
+
+def write_image(directory: str, name: str, data: bytes) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
@@ -1,9 +1,14 @@
 from flask import Flask
 from flask_restful import Api
 from app.resources import init_resources
-from app.models import create_tables
+from app.models import create_tables, init_db
+from app.services.ingest import init_ingest
+from app.services.metrics import init_metrics
 
 app = Flask(__name__)
+init_db(app)
+init_metrics(app)
+init_ingest(app)
 api = Api(app)
 init_resources(api)
 
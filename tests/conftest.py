@@ -0,0 +1,4 @@
+import os
+
+# 导入 app 之前设置好：测试不依赖 MySQL
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,109 @@
+import os
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Blob, Image, User
+from app.services.blob_store import write_atomic
+from app.services.image_processor import ImageService
+
+
+@pytest.fixture
+def db():
+    # 和 MySQL/InnoDB 一样强制外键约束
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def enable_foreign_keys(connection, _):
+        connection.execute('PRAGMA foreign_keys=ON')
+
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def make_blob(db, tmp_path, name: str, ref_count: int) -> Blob:
+    path = tmp_path / name
+    path.write_bytes(name.encode())
+    blob = Blob(content_hash=name * 8, file_path=str(path), file_size=len(name),
+                mime_type='image/png', ref_count=ref_count)
+    db.add(blob)
+    db.flush()
+    return blob
+
+
+def make_image(db, user: User, blob: Blob) -> Image:
+    image = Image(filename='a.png', storage_name='a.png', file_path=blob.file_path,
+                  file_size=blob.file_size, mime_type=blob.mime_type,
+                  content_hash=blob.content_hash, blob_id=blob.id, user_id=user.id)
+    db.add(image)
+    db.flush()
+    return image
+
+
+@pytest.fixture
+def user(db):
+    user = User(username='u', password='x')
+    db.add(user)
+    db.flush()
+    return user
+
+
+def test_delete_last_reference_removes_blob(db, tmp_path, user):
+    blob = make_blob(db, tmp_path, 'a', ref_count=2)
+    first, second = make_image(db, user, blob), make_image(db, user, blob)
+    db.commit()
+    blob_id, path = blob.id, blob.file_path
+    service = ImageService(db)
+
+    assert service.delete_image(first.id)
+    assert db.get(Blob, blob_id).ref_count == 1
+    assert tmp_path.joinpath('a').exists()
+
+    assert service.delete_image(second.id)
+    assert db.get(Blob, blob_id) is None
+    assert not tmp_path.joinpath('a').exists(), path
+
+
+def test_update_releases_old_blob_after_switching(db, tmp_path, user):
+    old = make_blob(db, tmp_path, 'old', ref_count=1)
+    image = make_image(db, user, old)
+    # 新 blob 的引用由调用方获取
+    new = make_blob(db, tmp_path, 'new', ref_count=1)
+    db.commit()
+    old_id = old.id
+
+    replacement = Image(filename='b.png', storage_name='b.png', file_path=new.file_path,
+                        file_size=new.file_size, mime_type=new.mime_type,
+                        content_hash=new.content_hash, blob_id=new.id)
+    assert ImageService(db).update_image(image.id, replacement)['id'] == image.id
+    assert db.get(Blob, old_id) is None
+    assert not tmp_path.joinpath('old').exists()
+    assert db.get(Image, image.id).blob_id == new.id
+
+
+def test_write_atomic_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'd' / 'same.webp')
+    errors = []
+
+    def write(data):
+        try:
+            for _ in range(50):
+                write_atomic(path, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(bytes([i]) * 4096,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(data) == 4096 and len(set(data)) == 1
+    assert os.listdir(tmp_path / 'd') == ['same.webp']
@@ -0,0 +1,99 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from app.services.cache import RedisCache  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_cache(server) -> RedisCache:
+    # 每个实例有自己的本地缓存，相当于另一个进程
+    return RedisCache(client=fakeredis.FakeRedis(server=server))
+
+
+def test_set_many_get_many_round_trip(server):
+    writer = make_cache(server)
+    writer.set_many({'a': 1, 'b': {'x': [1, 2], 'y': 'z'}}, expire=60)
+
+    reader = make_cache(server)
+    assert reader.get_many(['a', 'b', 'missing']) == {'a': 1, 'b': {'x': [1, 2], 'y': 'z'}}
+    # 第二次从本地缓存读出，Redis 中的值被删掉也不影响
+    server_client = fakeredis.FakeRedis(server=server)
+    server_client.delete('a', 'b')
+    assert reader.get_many(['a', 'b']) == {'a': 1, 'b': {'x': [1, 2], 'y': 'z'}}
+
+
+def test_get_many_returns_copies(server):
+    cache = make_cache(server)
+    cache.set_many({'k': {'items': [1]}})
+    cache.get_many(['k'])['k']['items'].append(2)
+    assert cache.get_many(['k']) == {'k': {'items': [1]}}
+
+
+def test_get_or_compute_single_flight_in_process(server):
+    cache = make_cache(server)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get_or_compute('shared', compute, expire=60))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+
+
+def test_get_or_compute_waits_for_other_process(server):
+    other = make_cache(server)
+    token = other.acquire_lock('lock:key', timeout=5)
+    assert token
+
+    def finish():
+        time.sleep(0.2)
+        other.set('key', 'from-other', expire=60)
+        other.release_lock('lock:key', token)
+    threading.Thread(target=finish).start()
+
+    def compute():
+        raise AssertionError('should reuse the other process result')
+    assert make_cache(server).get_or_compute('key', compute, wait_timeout=5) == 'from-other'
+
+
+def test_falls_back_to_local_tier_when_redis_is_down(server):
+    cache = make_cache(server)
+    server.connected = False
+
+    cache.set('k', {'v': 1}, expire=60)
+    assert cache.get('k') == {'v': 1}
+    assert not cache.health.available
+    assert cache.get_many(['k', 'other']) == {'k': {'v': 1}}
+    assert cache.get_or_compute('computed', lambda: 42) == 42
+    # Redis 不可用期间不再尝试，直接走本地缓存
+    assert cache.get('computed') == 42
+
+
+def test_pickled_entries_are_never_unpickled(server):
+    class Boom:
+        def __reduce__(self):
+            return (pytest.fail, ('pickle payload was executed',))
+
+    client = fakeredis.FakeRedis(server=server)
+    client.set('evil', b'\x01' + pickle.dumps(Boom()))
+    assert make_cache(server).get('evil') is None
+    assert make_cache(server).get_many(['evil']) == {}
@@ -0,0 +1,46 @@
+import pytest
+from PIL import Image as PILImage
+
+from app.models import Blob
+from app.services import orientation
+from app.services.blob_store import BlobService
+from app.services.decode import ImageOverBudget
+from app.services.executor import TRANSFORM_EXECUTOR_WORKERS, configure_executor
+from app.services.ingest import UnsupportedImage
+from app.services.metadata import EXIF_ORIENTATION
+
+
+@pytest.fixture(autouse=True)
+def inline_executor():
+    configure_executor(0)
+    yield
+    configure_executor(TRANSFORM_EXECUTOR_WORKERS)
+
+
+def rotated_jpeg(path, size=(64, 32)):
+    exif = PILImage.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    PILImage.new('RGB', size, 'red').save(path, format='JPEG', exif=exif)
+    return str(path)
+
+
+def test_upright_copy_replaces_stored_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(orientation, 'JPEGTRAN_PATH', None)
+    blob = Blob(file_path=rotated_jpeg(tmp_path / 'a.jpg'))
+    metadata = BlobService(None)._normalize_orientation(
+        blob, {'orientation': 6, 'frame_count': 1})
+    assert (metadata['width'], metadata['height'], metadata['orientation']) == (32, 64, 1)
+
+
+def test_rejects_when_decode_exceeds_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(orientation, 'JPEGTRAN_PATH', None)
+    monkeypatch.setattr(orientation, 'RENDER_MEMORY_BUDGET', 1024)
+    blob = Blob(file_path=rotated_jpeg(tmp_path / 'a.jpg'))
+    with pytest.raises(ImageOverBudget):
+        BlobService(None)._normalize_orientation(blob, {'orientation': 6, 'frame_count': 1})
+
+
+def test_rejects_animated_images_with_orientation(tmp_path):
+    blob = Blob(file_path=str(tmp_path / 'a.webp'))
+    with pytest.raises(UnsupportedImage):
+        BlobService(None)._normalize_orientation(blob, {'orientation': 6, 'frame_count': 3})
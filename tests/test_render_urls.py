@@ -0,0 +1,18 @@
+from app.services import render_urls
+
+
+def test_quality_dropped_for_lossless_source_without_fmt():
+    assert 'q' not in render_urls.canonicalize({'w': '100', 'q': '70'}, 'png')
+    assert 'q' not in render_urls.canonicalize({'w': '100', 'q': '70'}, 'gif')
+    assert render_urls.canonicalize({'w': '100', 'q': '70'}, 'png') == \
+        render_urls.canonicalize({'w': '100', 'q': '35'}, 'png')
+
+
+def test_quality_kept_for_lossy_output():
+    assert render_urls.canonicalize({'q': '72'}, 'jpeg')['q'] == '70'
+    assert render_urls.canonicalize({'q': '72', 'fmt': 'webp'}, 'png')['q'] == '70'
+    assert render_urls.canonicalize({'q': '72', 'fmt': 'auto'}, 'png')['q'] == '70'
+
+
+def test_explicit_lossless_fmt_drops_quality():
+    assert 'q' not in render_urls.canonicalize({'q': '72', 'fmt': 'png'}, 'jpeg')
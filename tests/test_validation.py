@@ -0,0 +1,62 @@
+import pytest
+
+from app.models import Image
+from app.resources.image import from_timestamp
+from app.services.executor import ExecutorBusy
+from app.services.image_processor import ImageTransformService
+
+
+@pytest.fixture
+def service():
+    return ImageTransformService(db=None)
+
+
+@pytest.fixture
+def image():
+    return Image(width=640, height=480)
+
+
+def test_crop_is_checked_against_source(service, image):
+    assert service.validate_transformations(
+        {'crop': {'x': 600, 'y': 0, 'width': 40, 'height': 480}}, image)
+    assert not service.validate_transformations(
+        {'crop': {'x': 600, 'y': 0, 'width': 41, 'height': 480}}, image)
+
+
+def test_crop_after_resize_uses_resized_size(service, image):
+    transformations = {'resize': {'width': 2000, 'height': 2000},
+                       'crop': {'x': 1000, 'y': 1000, 'width': 500, 'height': 500}}
+    assert service.validate_transformations(transformations, image)
+
+    transformations['crop']['x'] = 1600
+    assert not service.validate_transformations(transformations, image)
+
+
+def test_crop_after_rotate_uses_rotated_size(service, image):
+    # 旋转 90° 后为 480x640
+    transformations = {'rotate': {'angle': 90},
+                       'crop': {'x': 0, 'y': 500, 'width': 480, 'height': 140}}
+    assert service.validate_transformations(transformations, image)
+
+    transformations['crop']['x'] = 200
+    assert not service.validate_transformations(transformations, image)
+
+
+def test_crop_before_resize_uses_source_size(service, image):
+    assert not service.validate_transformations(
+        {'crop': {'x': 1000, 'y': 0, 'width': 100, 'height': 100},
+         'resize': {'width': 2000, 'height': 2000}}, image)
+
+
+def test_single_op_helpers_keep_http_errors(service, monkeypatch):
+    def busy(*args, **kwargs):
+        raise ExecutorBusy()
+    monkeypatch.setattr(service, '_render', busy)
+    with pytest.raises(ExecutorBusy):
+        service.resize_image(1, {'width': 10, 'height': 10})
+
+
+@pytest.mark.parametrize('value', [1e20, -1e20, float('inf'), float('nan')])
+def test_out_of_range_timestamps_are_invalid(value):
+    with pytest.raises(ValueError, match='created_after'):
+        from_timestamp(value, 'created_after')
@@ -0,0 +1,9 @@
+import argparse
+from app.services.worker import run_workers, JOB_WORKERS
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run image transform workers')
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS,
+                        help='number of worker processes')
+    run_workers(parser.parse_args().workers)